@@ -0,0 +1,51 @@
+import sys
+import time
+import helpers
+from helpers import _make_array, _encode_shard
+from conllu import read_blocks
+from mappings import column2mapping
+
+def bench_encoding(path, conf):
+    """Compares _make_array() sentence by sentence with _encode_shard()
+    on one NN input file, and checks they give the same ids."""
+    mapping = column2mapping[conf]
+    with open(path, 'r') as fin:
+        text = fin.read()
+
+    start = time.perf_counter()
+    with open(path, 'r') as fin:
+        old = [_make_array(sent, mapping) for sent in read_blocks(fin)]
+    t_old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X, Y, offsets = _encode_shard(text, mapping)
+    t_new = time.perf_counter() - start
+
+    for i, (X_sent, Y_sent) in enumerate(old):
+        assert (X_sent == X[offsets[i]:offsets[i+1]]).all()
+        assert list(Y_sent) == list(Y[offsets[i]:offsets[i+1]])
+
+    n_tokens = len(X)
+    print('{}: {} sentences, {} tokens'.format(path, len(old), n_tokens))
+    print('  _make_array:   {:.3f}s ({:.0f} tokens/s)'.format(t_old, n_tokens / t_old))
+    print('  _encode_shard: {:.3f}s ({:.0f} tokens/s), {:.1f}x'.format(t_new, n_tokens / t_new, t_old / t_new))
+
+def profile_loaders(confs, target_lang, files, report_dir=None, seq_len=80):
+    """Loads `files' for each configuration with profiling on (without the on-disk
+    cache, to see the cost of encoding) and prints the stages of every load.
+    report_dir: where to save one JSON report per load."""
+    helpers.enable_profiling(report_dir)
+    try:
+        for conf in confs:
+            helpers.load_data_from_files(seq_len, conf, target_lang, files, cache_dir=None)
+    finally:
+        helpers.disable_profiling()
+    print(helpers.profile_summary())
+
+if __name__ == '__main__':
+    # python benchmarks.py data/english/pos_dep_morph/0.txt pos_dep_morph
+    # python benchmarks.py --profile en 0 1 2 (all configurations, reports in profiles/)
+    if sys.argv[1] == '--profile':
+        profile_loaders(sorted(column2mapping), sys.argv[2], [int(f) for f in sys.argv[3:]], 'profiles')
+    else:
+        bench_encoding(sys.argv[1], sys.argv[2])
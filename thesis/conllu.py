@@ -1,4 +1,54 @@
 from collections import defaultdict
+from collections.abc import Mapping
+from bisect import bisect_left
+from functools import lru_cache
+import mmap
+import os
+import sys
+import threading
+import numpy as np
+from mappings import column2mapping, superset_columns, bio, bool2idx, pos2idx, rel2idx, definite2idx, gender2idx, number2idx, prontype2idx, person2idx, poss2idx, numtype2idx, case2idx
+
+# Morph features used as NN input, in column order, and their mappings.
+MORPH_FEATS = ('Definite', 'Gender', 'Number', 'PronType', 'Person', 'Poss', 'NumType', 'Case')
+MORPH_MAPPINGS = (definite2idx, gender2idx, number2idx, prontype2idx, person2idx, poss2idx, numtype2idx, case2idx)
+
+@lru_cache(maxsize=8192)
+def parse_feats(feats):
+    """Returns the values of the MORPH_FEATS in a FEATS string as an 8-tuple,
+    with an underscore for every feature that is absent.
+    The same FEATS strings come up over and over in a treebank, so results are cached."""
+    if feats == '_':
+        return ('_',) * len(MORPH_FEATS)
+    feats_dict = dict(f.split('=', 1) for f in feats.split('|'))
+    return tuple(feats_dict.get(k, '_') for k in MORPH_FEATS)
+
+def map_value(mapping, value):
+    """Id of a feature value in one of the mappings of mappings.py, as every loader
+    gets it: subtypes (`feat:subtype') go with their main type, and values missing
+    from the mapping get its OOV id (morph features). Mappings without an OOV id
+    (UPOS, deprels) raise a KeyError, so nothing unknown gets the padding id 0."""
+    main = value.split(':')[0]
+    if main in mapping:
+        return mapping[main]
+    if 'OOV' in mapping:
+        return mapping['OOV']
+    raise KeyError(value)
+
+def _map_ids(mapping, values):
+    """map_value() of every value, -1 where it raises a KeyError."""
+    ids = []
+    for v in values:
+        try:
+            ids.append(map_value(mapping, v))
+        except KeyError:
+            ids.append(-1)
+    return np.array(ids, dtype=np.intp)
+
+@lru_cache(maxsize=8192)
+def encode_feats(feats):
+    """Same as parse_feats() but gives the ids from mappings.py, see map_value()."""
+    return tuple(map_value(m, v) for m, v in zip(MORPH_MAPPINGS, parse_feats(feats)))
 
 class Tree:
 
@@ -32,6 +82,9 @@ class Tree:
 
     class Token:
 
+        # Slots instead of a __dict__, there are millions of these in a full treebank.
+        __slots__ = ('idx', 'form', 'lemma', 'pos', 'xpos', 'feats', 'head', 'rel', 'deps', 'misc', 'bnp', 'nnfeat')
+
         def __init__(self, idx, form, lemma, pos, xpos, feats, head, rel, deps, misc, bnp=None):
             """Takes in a tuple of attributes"""
             self.idx = idx
@@ -49,28 +102,10 @@ class Tree:
 
         def _get_mf(self):
             """Returns gender and number of a token. Masc vs Fem. Plur vs Sing.
-            If either is absent, an underscore is given."""
-            if self.feats != '_':
-                cols = self.feats.split('|')
-                feats_dict = dict()
-                for i in cols:
-                    k, v = i.split('=')
-                    feats_dict[k] = v
-
-                d = feats_dict['Definite'] if 'Definite' in feats_dict else '_'
-                g = feats_dict['Gender'] if 'Gender' in feats_dict else '_'
-                n = feats_dict['Number'] if 'Number' in feats_dict else '_'
-                pt = feats_dict['PronType'] if 'PronType' in feats_dict else '_'
-                p  = feats_dict['Person'] if 'Person' in feats_dict else '_'
-                ps = feats_dict['Poss'] if 'Poss' in feats_dict else '_'
-                nt = feats_dict['NumType'] if 'NumType' in feats_dict else '_'
-                c = feats_dict['Case'] if 'Case' in feats_dict else '_'
-
-                return  d,   g,   n,   pt,  p,   ps,  nt,  c
-            else:
-                return '_', '_', '_', '_', '_', '_', '_', '_'
-            
-            
+            If either is absent, an underscore is given.
+            (In fact all MORPH_FEATS, see parse_feats().)"""
+            return parse_feats(self.feats)
+
         def is_dep_prev(self):
             """If this Token is a dep of previous Token"""
             return True if self.idx - self.head == 1 else False
@@ -85,12 +120,20 @@ class Tree:
         # TODO Implement other methods to output other trainable features,
         # will be called `nnfeat' to distinguish from morphological features.
 
-    def __init__(self, string, bnp_marked=False):
-        """Initialize the object from a string represents a tree"""
-        self.tokens = {}  # A dictionary that organizes tokens
-        self.children = defaultdict(list) 
-
+    # Option of output_nnfeats() -> method that extracts it.
+    FEAT_METHODS = {'pos': '_feat_pos', 'pos_deprel': '_feat_pos_deprel', 'pos_dep': '_feat_pos_dep',
+                    'pos_dep_parent': '_feat_pos_dep_parent', 'pos_dep_grand': '_feat_pos_dep_grand',
+                    'pos_parent': '_feat_pos_parent', 'pos_grand': '_feat_pos_grand',
+                    'pos_parent_child': '_feat_pos_parent_child',
+                    'pos_dep_parent_child': '_feat_pos_dep_parent_child'}
+
+    def __init__(self, string, bnp_marked=False, compact=False):
+        """Initialize the object from a string represents a tree
+        compact: if True, tokens are stored column-wise (see _init_columns())
+            instead of as one Token object per token. Use this on large treebanks."""
         self.sentid_line = ''
+        self.compact = compact
+        rows = []
         for l in string.split('\n'):
             if l.startswith("# sent_id"):
                 self.sentid_line = l
@@ -100,6 +143,15 @@ class Tree:
                     idx = int(cols[0])
                 except ValueError:
                     continue
+                rows.append(cols)
+
+        if compact:
+            self._init_columns(rows, bnp_marked)
+        else:
+            self.tokens = {}  # A dictionary that organizes tokens
+            self.children = defaultdict(list)
+            for cols in rows:
+                idx = int(cols[0])
                 form = cols[1]
                 lemma = cols[2]
                 pos = cols[3]
@@ -118,6 +170,41 @@ class Tree:
 
         # This may not be necessary if we implement a method.
         self.bnp_marked = bnp_marked 
+        self._struct = None # See structure()
+        self._morph = None # See _morph_rows()
+
+    def _init_columns(self, rows, bnp_marked):
+        """Compact storage. Every column is a list or array indexed by token ID,
+        position 0 is the root:
+        - head, UPOS and deprel are NumPy int arrays, UPOS and deprel being ids in
+          the corpus-wide vocabularies _UPOS and _DEPREL;
+        - the other columns are lists of interned strings, so repeated forms,
+          lemmas and FEATS share one object across the whole treebank.
+        self.tokens and self.children are read-only views over these columns."""
+        n = len(rows)
+        self._head = np.zeros(n+1, dtype=np.int16)
+        self._upos = np.zeros(n+1, dtype=np.uint16)
+        self._deprel = np.zeros(n+1, dtype=np.uint16)
+        self._form = ['ROOT']
+        self._lemma = ['_']
+        self._xpos = ['_']
+        self._feats = ['_']
+        self._deps = ['_']
+        self._misc = ['_']
+        self._bnp = [None]
+        for i, cols in enumerate(rows, 1):
+            self._form.append(sys.intern(cols[1]))
+            self._lemma.append(sys.intern(cols[2]))
+            self._upos[i] = _UPOS.index(cols[3])
+            self._xpos.append(sys.intern(cols[4]))
+            self._feats.append(sys.intern(cols[5]))
+            self._head[i] = int(cols[6])
+            self._deprel[i] = _DEPREL.index(cols[7])
+            self._deps.append(sys.intern(cols[8]))
+            self._misc.append(sys.intern(cols[9]))
+            self._bnp.append(sys.intern(cols[10]) if bnp_marked else None)
+        self.tokens = _TokenTable(self)
+        self.children = _ChildTable(self._head)
 
     def __len__(self):
         return len(self.tokens)
@@ -151,6 +238,8 @@ class Tree:
         return lemmas
 
     def list_bios(self):
+        if self.compact:
+            return self._bnp[1:]
         bios = []
         for i in self.tokens:
             bios.append(self.tokens[i].bnp)
@@ -186,55 +275,70 @@ class Tree:
 
         # These two numbers will be useful to see if all Minimal NPs found in PTBs
         # are marked.
-        ph_count = len(phrases)
-        ph_copy = phrases.copy()
-        phw_count = sum(map(len, phrases))
+        ph_count, phw_count, b_count, bw_count = self._align_bnp(phrases)
+
+        if ph_count == b_count and phw_count == bw_count:
+            return 'PERFECT! Total phrases: {}. Total words: {}.'.format(ph_count, phw_count)
+        else:
+            return 'XXXXXXX! Marked phrases: {}. Marked tokens: {}.\n{}'.format(b_count/(ph_count+0.0000001), bw_count/(phw_count+0.0000001), str(phrases))
+
+    def _align_bnp(self, phrases):
+        """Marks phrases with B and I, everything else with O.
+        Phrases are matched in order, each at the first position after the start
+        of the previous match. A `*T*' in a phrase matches any DET.
+        Instead of trying every position, candidate positions come from an index
+        of where each form occurs, built once for the sentence.
+        Returns the numbers of phrases, phrase words, marked phrases and marked words."""
+
+        n = len(self.tokens)
+        forms = [None] + self.list_forms()
+        pos = self.list_pos() # 'ROOT' at 0
+        where = defaultdict(list) # form -> positions, in order
+        for i in range(1, n+1):
+            where[forms[i]].append(i)
+        where_det = [i for i in range(1, n+1) if pos[i] == 'DET']
+
         b_count = 0
         bw_count = 0
         pointer = 1
-
-        while phrases:
-            p = phrases.pop(0) # Current phrase
+        for p in phrases:
             lphrase = len(p)
-
-            while pointer <= len(self.tokens)-lphrase:
-                tokens_to_match = [] 
-                for j in range(lphrase):
-                    tokens_to_match.append(self.tokens[pointer+j])
-                
-                # This self._match() method will take care of matching.
-                # If the phrases match, tokens will be marked BI,
-                # if not, they are marked O.
-                # The return avalue is either True or False, meaning if they are
-                # matched successfully.
-                if self._match(p, tokens_to_match):
-                    # print('We have a match')
-                    # print(p)
-                    # print(tokens_to_match)
-                    for i in range(len(tokens_to_match)):
-                        # print(tokens_to_match[i].form)
-                        if i == 0:
-                            tokens_to_match[i].bnp = 'B'
-                            b_count += 1
-                            bw_count += 1
-                        else:
-                            tokens_to_match[i].bnp = 'I'
-                            bw_count += 1
+            last = n - lphrase # Last start position tried.
+            if lphrase == 0:
+                # An empty phrase matches anywhere and marks nothing.
+                if pointer <= last:
                     pointer += 1
+                continue
+
+            # Anchor on the first real word of the phrase, or on DETs if all are `*T*'.
+            k = next((k for k, word in enumerate(p) if word != '*T*'), 0)
+            candidates = where_det if p[k] == '*T*' else where.get(p[k], [])
+            start = None
+            for q in candidates[bisect_left(candidates, pointer+k):]:
+                s = q - k
+                if s > last:
+                    break
+                if all(word == forms[s+j] or (word == '*T*' and pos[s+j] == 'DET')
+                       for j, word in enumerate(p)):
+                    start = s
                     break
-                else:
-                    pointer += 1
 
-        for tok in self.tokens:
-            if not self.tokens[tok].bnp:
-                self.tokens[tok].bnp = 'O'
+            if start is None:
+                pointer = max(pointer, last+1)
+                continue
+            self.tokens[start].bnp = 'B'
+            for j in range(1, lphrase):
+                self.tokens[start+j].bnp = 'I'
+            b_count += 1
+            bw_count += lphrase
+            pointer = start + 1
 
-        self.bnp_marked = True
+        for tok in self.tokens.values():
+            if not tok.bnp:
+                tok.bnp = 'O'
 
-        if ph_count == b_count and phw_count == bw_count:
-            return 'PERFECT! Total phrases: {}. Total words: {}.'.format(ph_count, phw_count)
-        else:
-            return 'XXXXXXX! Marked phrases: {}. Marked tokens: {}.\n{}'.format(b_count/(ph_count+0.0000001), bw_count/(phw_count+0.0000001), str(ph_copy))
+        self.bnp_marked = True
+        return len(phrases), sum(map(len, phrases)), b_count, bw_count
 
     def output_ext_tree(self):
         """This method prints the dep tree with bnps
@@ -243,14 +347,13 @@ class Tree:
         # TODO Wait! How do they treat stuff like
         # y-a-t'il in the French UD?
         assert self.bnp_marked == True
-        output = self.sentid_line+'\n'
+        lines = [self.sentid_line+'\n']
         for tok in self.tokens.values():
-            line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
+            lines.append('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
                 tok.idx, tok.form, tok.lemma, tok.pos, tok.xpos, tok.feats, tok.head, tok.rel, tok.deps, tok.misc, tok.bnp
-            )
-            output += line
-        output += '\n'
-        return output
+            ))
+        lines.append('\n')
+        return ''.join(lines)
 
     def output_nnfeats(self, option, morph_feats = False):
         """Use command to output nn feats (labels are always output):
@@ -272,28 +375,33 @@ class Tree:
         - pos_dep_parent_child: 1) POS of token, 2) rel to parent, 3) POS of parent;
                 4) rel from left-most child to current token; 5) POS of left-most child.
         """
-        mapping = {'pos':self._feat_pos(mf=morph_feats), 'pos_deprel': self._feat_pos_deprel(mf=morph_feats), 'pos_dep':self._feat_pos_dep(mf=morph_feats), 'pos_dep_parent':self._feat_pos_dep_parent(mf=morph_feats), 'pos_dep_grand':self._feat_pos_dep_grand(mf=morph_feats), 'pos_parent':self._feat_pos_parent(mf=morph_feats), 'pos_grand':self._feat_pos_grand(mf=morph_feats), 'pos_parent_child':self._feat_pos_parent_child(mf=morph_feats), 'pos_dep_parent_child': self._feat_pos_dep_parent_child(mf=morph_feats)}
-        assert option in mapping.keys()
-
-        return mapping[option]
+        # Only the extractor for `option' is run.
+        assert option in self.FEAT_METHODS
+        return getattr(self, self.FEAT_METHODS[option])(mf=morph_feats)
+
+    def output_nnfeats_many(self, confs):
+        """Outputs several configurations at once, as a dict conf -> output.
+        confs: configuration names as in network_traininng.configurations,
+            eg. 'pos_dep_parent' or 'pos_dep_parent_morph' (see split_conf()).
+        The per-tree work (structure(), morph features, BIO labels) is done once
+        and shared between all configurations."""
+        output = {}
+        for conf in confs:
+            option, morph_feats = split_conf(conf)
+            output[conf] = self.output_nnfeats(option, morph_feats)
+        return output
 
-    def _feat_pos(self, mf):
+    def _feat_pos(self, mf, encode=False, out=None):
         """Outputs:
             1) POS current token
         Or:
             1-9) POS plus a series of morph features of current token
         """
-        output = ''
-        for i in self.tokens:
-            if not mf:
-                line = '{}\t{}\n'.format(self.tokens[i].pos, self.tokens[i].bnp)
-            else:
-                f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(self.tokens[i].pos, f1, f2, f3, f4, f5, f6, f7, f8, self.tokens[i].bnp)
-            output += line
-        return output + '\n'
+        st = self.structure()
+        pos, rel = self._tables(encode)
+        return self._emit([pos[st['ids']]], mf, encode, out)
 
-    def _feat_pos_dep(self, mf):
+    def _feat_pos_dep(self, mf, encode=False, out=None):
         """Outputs:
             1) POS of current token;
             2) relation with previous token, if it's head; 
@@ -303,31 +411,16 @@ class Tree:
             10) True if the previous token is head, False if not; 
             11) True if the next token is head, False if not.
         """
-        
-        output = ''
-        for i in self.tokens:
-            previous_tok_is_head = ((i - self.tokens[i].head) == 1)
-            next_tok_is_head = ((self.tokens[i].head - i) == 1)
-            if not mf:
-                line = '{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos,
-                    previous_tok_is_head,
-                    next_tok_is_head,
-                    self.tokens[i].bnp
-                )
-            else:
-                f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos, f1, f2, f3, f4, f5, f6, f7, f8,
-                    previous_tok_is_head,
-                    next_tok_is_head,
-                    self.tokens[i].bnp
-                )
-            output += line
-        
-        return output + '\n'
 
-    def _feat_pos_deprel(self, mf):
+        st = self.structure()
+        ids = st['ids']
+        pos, rel = self._tables(encode)
+        head = st['head'][ids]
+        previous_tok_is_head = self._bools(ids - head == 1, encode)
+        next_tok_is_head = self._bools(head - ids == 1, encode)
+        return self._emit([pos[ids], previous_tok_is_head, next_tok_is_head], mf, encode, out)
+
+    def _feat_pos_deprel(self, mf, encode=False, out=None):
 
         """Outputs:
             1) POS of current token;
@@ -338,39 +431,17 @@ class Tree:
             10) relation with previous token, if it's head; 
             11) relation with next token, if it's head.
         """
-        
-        output = ''
-        for i in self.tokens:
-            if (i - self.tokens[i].head) == 1:
-                previous_tok_is_head = self.tokens[i].rel
-            else:
-                previous_tok_is_head = '_'
-            
-            if (self.tokens[i].head - i) == 1:
-                next_tok_is_head = self.tokens[i].rel
-            else:
-                next_tok_is_head = '_'
-            
-            if not mf:
-                line = '{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos,
-                    previous_tok_is_head,
-                    next_tok_is_head,
-                    self.tokens[i].bnp
-                )
-            else:
-                f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos, f1, f2, f3, f4, f5, f6, f7, f8,
-                    previous_tok_is_head,
-                    next_tok_is_head,
-                    self.tokens[i].bnp
-                )
-
-            output += line
-        return output +'\n'
+
+        st = self.structure()
+        ids = st['ids']
+        pos, rel = self._tables(encode)
+        head = st['head'][ids]
+        # rel[0] is the underscore (or its id).
+        previous_tok_is_head = np.where(ids - head == 1, rel[ids], rel[0])
+        next_tok_is_head = np.where(head - ids == 1, rel[ids], rel[0])
+        return self._emit([pos[ids], previous_tok_is_head, next_tok_is_head], mf, encode, out)
     
-    def _feat_pos_dep_parent(self, mf):
+    def _feat_pos_dep_parent(self, mf, encode=False, out=None):
         """Outputs:
             1) POS; 2) rel to parent; 3) POS of parent.
         If gn turned on:
@@ -378,35 +449,9 @@ class Tree:
             10) rel to parent;
             11) POS of parent.
         """
-
-        output = ''
-
-        for i in self.tokens:
-            if self.tokens[i].head:
-                parent_pos = self.tokens[self.tokens[i].head].pos
-            else:
-                parent_pos = '_'
-
-            if not mf:
-                line = '{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos,
-                    self.tokens[i].rel,
-                    parent_pos,
-                    self.tokens[i].bnp
-                )
-            else:
-                f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-                #       1   2   3   4   5   6   7   8   9   10  11  12
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos, f1, f2, f3, f4, f5, f6, f7, f8,
-                    self.tokens[i].rel,
-                    parent_pos,
-                    self.tokens[i].bnp
-                )
-            output += line
-        return output + '\n'
+        return self._feat_pos_ancestors(mf, depth=1, dep=True, encode=encode, out=out)
     
-    def _feat_pos_dep_grand(self, mf):
+    def _feat_pos_dep_grand(self, mf, encode=False, out=None):
         """Outputs:
             1) POS of current token; 2) rel from current to parent token; 3) parent POS;
             4) parent to grand rel; 5) grand pos.
@@ -417,80 +462,16 @@ class Tree:
             12) rel from parent to grandparent token;
             14) POS, gender, number of grandparent token.
         """
-        
-        output = ''
-
-        for i in self.tokens:
-            p_idx = self.tokens[i].head
-
-            if p_idx:
-                parent_pos = self.tokens[p_idx].pos
-                parent_to_grand_rel = self.tokens[p_idx].rel
+        return self._feat_pos_ancestors(mf, depth=2, dep=True, encode=encode, out=out)
 
-                grand_idx = self.tokens[p_idx].head
-                if grand_idx != 0:
-                    grand_pos = self.tokens[grand_idx].pos
-                else:
-                    grand_pos = '_'
-            else:
-                parent_pos = '_'
-                grand_pos = '_'
-                parent_to_grand_rel = '_'
-
-            if not mf:
-                line = '{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos,
-                    self.tokens[i].rel,
-                    parent_pos,
-                    parent_to_grand_rel,
-                    grand_pos,
-                    self.tokens[i].bnp
-                )
-            else:
-                f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-                #       1   2   3   4   5    6   7  8   9  10   11  12  13  14
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos, f1, f2, f3, f4, f5, f6, f7, f8, self.tokens[i].rel,
-                    parent_pos, parent_to_grand_rel,
-                    grand_pos,
-                    self.tokens[i].bnp
-                )
-            output += line
-        return output + '\n'
-
-    def _feat_pos_parent(self, mf):
+    def _feat_pos_parent(self, mf, encode=False, out=None):
         """Outputs 1) POS tag, 2) parent POS tag.
         If gn turned on:
         1-9) POS morph features of current token; and
         10) POS of parent token."""
+        return self._feat_pos_ancestors(mf, depth=1, encode=encode, out=out)
 
-        output = ''
-
-        for i in self.tokens:
-            if self.tokens[i].head:
-                parent_pos = self.tokens[self.tokens[i].head].pos
-            else:
-                parent_pos = '_'
-
-            if not mf:                
-                line = '{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos,
-                    parent_pos,
-                    self.tokens[i].bnp
-                )
-            else:
-                f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-                #        1  2   3   4   5   6   7   8   9   10  11
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos, f1, f2, f3, f4, f5, f6, f7, f8,
-                    parent_pos,
-                    self.tokens[i].bnp
-                )
-
-            output += line
-        return output + '\n'
-
-    def _feat_pos_grand(self, mf):
+    def _feat_pos_grand(self, mf, encode=False, out=None):
         """Outputs:
         1) POS of current token,
         2) of parent token,
@@ -500,44 +481,26 @@ class Tree:
         10) POS of parent token; and
         11) POS of grandparent token.
         """
-
-        output = ''
-
-        for i in self.tokens:
-            p_idx = self.tokens[i].head
-
-            if p_idx:
-                parent_pos = self.tokens[p_idx].pos
-                grand_idx = self.tokens[p_idx].head
-                if grand_idx != 0:
-                    grand_pos = self.tokens[grand_idx].pos
-                else:
-                    grand_pos = '_'
-
-            else:
-                parent_pos = '_'
-                grand_pos = '_'
-
-            if not mf:
-                line = '{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos,
-                    parent_pos,
-                    grand_pos,
-                    self.tokens[i].bnp
-                )
-            else:
-                f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-                #       1   2   3   4   5   6   7   8   9   10  11  12
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    self.tokens[i].pos, f1, f2, f3, f4, f5, f6, f7, f8,
-                    parent_pos,
-                    grand_pos,
-                    self.tokens[i].bnp
-                )
-            output += line
-        return output + '\n'
-
-    def _feat_pos_parent_child(self, mf):
+        return self._feat_pos_ancestors(mf, depth=2, encode=encode, out=out)
+
+    def _feat_pos_ancestors(self, mf, depth, dep=False, encode=False, out=None):
+        """Generalizes _feat_pos_parent() (depth=1) and _feat_pos_grand() (depth=2)
+        to any number of ancestors. Outputs:
+            1) POS of current token; then for every ancestor, its POS.
+        If dep is True, the rel to each ancestor goes before its POS, as in
+        _feat_pos_dep_parent() and _feat_pos_dep_grand().
+        Ancestors above the root are given as underscores."""
+        st = self.structure(depth)
+        ids = st['ids']
+        pos, rel = self._tables(encode)
+        columns = [pos[ids]]
+        for d in range(1, depth+1):
+            if dep:
+                columns.append(rel[st['anc'][d-1, ids]])
+            columns.append(pos[st['anc'][d, ids]])
+        return self._emit(columns, mf, encode, out)
+
+    def _feat_pos_parent_child(self, mf, encode=False, out=None):
         """Outputs in a file:
         1) POS of current token,
         2) POS of parent token,
@@ -548,40 +511,15 @@ class Tree:
         10) POS of parent token; and
         11, 12) POS of leftmost and rightmost child token."""
 
-        output = ''
-        for i in self.tokens:
-            this_pos = self.tokens[i].pos
-            f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-            p_idx = self.tokens[i].head
-            p_pos = self.tokens[p_idx].pos if p_idx else '_'
-            # Getting the left most child is simple, it has min index value.
-            # This is more or less an arbitrary decision.
-            left_child_idx = min(self.children[i]) if self.children[i] else 0
-            left_child_pos = self.tokens[left_child_idx].pos if left_child_idx else '_'
-
-            right_child_idx = max(self.children[i]) if self.children[i] else 0
-            if right_child_idx and right_child_idx != left_child_idx:
-                right_child_pos = self.tokens[right_child_idx].pos
-            else:
-                right_child_pos = '_'
+        st = self.structure()
+        ids = st['ids']
+        pos, rel = self._tables(encode)
+        # Getting the left most child is simple, it has min index value.
+        # This is more or less an arbitrary decision.
+        columns = [pos[ids], pos[st['head'][ids]], pos[st['lchild'][ids]], pos[st['rchild'][ids]]]
+        return self._emit(columns, mf, encode, out)
 
-            if not mf:
-                line = '{}\t{}\t{}\t{}\t{}\n'.format(
-                    this_pos, p_pos, left_child_pos, right_child_pos, self.tokens[i].bnp
-                )
-            else:
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    this_pos, f1, f2, f3, f4, f5, f6, f7, f8,
-                    p_pos,
-                    left_child_pos,
-                    right_child_pos,
-                    self.tokens[i].bnp
-                )
-            output += line
-
-        return output +'\n'
-
-    def _feat_pos_dep_parent_child(self, mf):
+    def _feat_pos_dep_parent_child(self, mf, encode=False, out=None):
         """- pos_dep_parent_child:
             1) POS of token, 2) rel to parent, 3) POS of parent;
             4-5) POS of left-most child, rel from left-most child to current token; and
@@ -593,47 +531,171 @@ class Tree:
             12-13) POS of leftmost child, leftmost-child-to-current deprel;
             14-15) POS of rightmost child, rightmost-child-to-current deprel."""
 
-        output = ''
-        
-        for i in self.tokens:
-            this_pos = self.tokens[i].pos
-            this_dep = self.tokens[i].rel
-            f1, f2, f3, f4, f5, f6, f7, f8 = self.tokens[i]._get_mf()
-            p_idx = self.tokens[i].head
-            p_pos = self.tokens[p_idx].pos if p_idx else '_'
-
-            left_child_idx = min(self.children[i]) if self.children[i] else 0
-            left_child_pos = self.tokens[left_child_idx].pos if left_child_idx else '_'
-            left_child_dep = self.tokens[left_child_idx].rel if left_child_idx else '_'
-
-            right_child_idx = max(self.children[i]) if self.children[i] else 0
-            if right_child_idx and right_child_idx != left_child_idx:
-                right_child_pos = self.tokens[right_child_idx].pos
-                right_child_dep = self.tokens[right_child_idx].rel
-            else:
-                right_child_pos = '_'
-                right_child_dep = '_'
-
-            if not mf:
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    this_pos, this_dep, p_pos,
-                    left_child_dep, left_child_pos,
-                    right_child_dep, right_child_pos,
-                    self.tokens[i].bnp
-                )
+        st = self.structure()
+        ids = st['ids']
+        pos, rel = self._tables(encode)
+        lchild, rchild = st['lchild'][ids], st['rchild'][ids]
+        columns = [pos[ids], rel[ids], pos[st['head'][ids]],
+                   rel[lchild], pos[lchild],
+                   rel[rchild], pos[rchild]]
+        return self._emit(columns, mf, encode, out)
+
+    def structure(self, depth=2):
+        """Arrays behind the tree-relational features, all indexed by token ID
+        with 0 standing for the root:
+        - 'ids': IDs of the tokens, in order;
+        - 'head': ID of the head of each token;
+        - 'anc': shape (depth+1, n+1); anc[d] holds the d-th ancestor of each token,
+                 0 once we go past the root. Built by pointer jumping;
+        - 'lchild', 'rchild': leftmost and rightmost child, 0 if there is none.
+                 rchild is also 0 if it is the same token as lchild;
+        - 'pos', 'rel': UPOS and deprel strings, '_' at 0;
+        - 'pos_id', 'rel_id': the same as ids from pos2idx and rel2idx (see
+                 map_value()), -1 for unknown UPOS or deprels.
+        Computed once per tree; asking for a larger depth extends `anc'."""
+
+        if self._struct is None:
+            if self.compact:
+                head = self._head.astype(np.intp)
+                pos = np.array(_UPOS.strings, dtype=object)[self._upos]
+                rel = np.array(_DEPREL.strings, dtype=object)[self._deprel]
+                pos_id = _UPOS.to_mapping(pos2idx)[self._upos]
+                rel_id = _DEPREL.to_mapping(rel2idx)[self._deprel]
             else:
-                #        1  2   3   4   5    6   7   8   9  10  11  12  13  14  15  16
-                line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
-                    this_pos, f1, f2, f3, f4, f5, f6, f7, f8,
-                    this_dep, p_pos,
-                    left_child_dep, left_child_pos,
-                    right_child_dep, right_child_pos,
-                    self.tokens[i].bnp
-                )
-
-            output += line
-        
-        return output +'\n'
+                n = max(self.tokens, default=0)
+                head = np.zeros(n+1, dtype=np.intp)
+                pos = np.full(n+1, '_', dtype=object)
+                rel = np.full(n+1, '_', dtype=object)
+                for i, tok in self.tokens.items():
+                    head[i] = tok.head
+                    pos[i] = tok.pos
+                    rel[i] = tok.rel
+                pos_id = _map_ids(pos2idx, pos)
+                rel_id = _map_ids(rel2idx, rel)
+            n = len(head) - 1
+            ids = np.arange(1, n+1)
+
+            # Leftmost and rightmost children: scatter every token's ID onto its head.
+            lchild = np.full(n+1, n+1, dtype=np.intp)
+            rchild = np.zeros(n+1, dtype=np.intp)
+            np.minimum.at(lchild, head[ids], ids)
+            np.maximum.at(rchild, head[ids], ids)
+            lchild[lchild == n+1] = 0
+            rchild[rchild == lchild] = 0
+
+            self._struct = {'ids': ids, 'head': head, 'anc': np.stack([np.arange(n+1), head]),
+                            'lchild': lchild, 'rchild': rchild, 'pos': pos, 'rel': rel,
+                            'pos_id': pos_id, 'rel_id': rel_id}
+
+        anc = self._struct['anc']
+        if len(anc) <= depth:
+            # Pointer jumping: the (m+r)-th ancestor is the m-th ancestor of the r-th,
+            # so every round doubles the depth covered.
+            anc = list(anc)
+            while len(anc) <= depth:
+                top = anc[-1]
+                anc.extend(top[a] for a in anc[1:])
+            self._struct['anc'] = np.stack(anc[:depth+1])
+        return self._struct
+
+    def _tables(self, encode):
+        """UPOS and deprel of every token ID, as strings or as ids.
+        Ids of UPOS or deprels missing from mappings.py raise a KeyError,
+        as helpers._make_array() does on the TSV output."""
+        st = self.structure()
+        if encode:
+            for ids, strings in ((st['pos_id'], st['pos']), (st['rel_id'], st['rel'])):
+                if (ids < 0).any():
+                    raise KeyError(strings[np.argmax(ids < 0)])
+            return st['pos_id'], st['rel_id']
+        return st['pos'], st['rel']
+
+    def _bools(self, mask, encode):
+        """A boolean column as 'True'/'False' strings or as bool2idx ids."""
+        if encode:
+            return np.where(mask, bool2idx['True'], bool2idx['False'])
+        return np.where(mask, 'True', 'False')
+
+    def _emit(self, columns, mf, encode, out):
+        """Either formats the feature columns as TSV (see _format_rows()),
+        or writes their ids into an int array of shape (n_tokens, n_columns),
+        `out' if given. Morph features go right after the first column."""
+        if not encode:
+            return self._format_rows(columns, mf)
+        n_columns = len(columns) + (len(MORPH_FEATS) if mf else 0)
+        if out is None:
+            out = np.empty((len(self.tokens), n_columns), dtype=np.int32)
+        out[:, 0] = columns[0]
+        rest = 1
+        if mf:
+            out[:, 1:1+len(MORPH_FEATS)] = self._morph_ids().reshape(-1, len(MORPH_FEATS))
+            rest += len(MORPH_FEATS)
+        for j, col in enumerate(columns[1:], rest):
+            out[:, j] = col
+        return out
+
+    def encode(self, conf, out=None):
+        """Encodes configuration `conf' (eg. 'pos_dep_morph') straight into ids,
+        the same ids helpers._make_array() gets from the TSV output via
+        mappings.column2mapping[conf], unknown values included (see map_value()).
+        No text is produced.
+        out: optional preallocated int array of shape (n_tokens, len(column2mapping[conf])).
+        Returns (X, Y): X as `out'; Y the label ids from mappings.bio (0 if not marked)."""
+        option, morph_feats = split_conf(conf)
+        assert option in self.FEAT_METHODS
+        X = getattr(self, self.FEAT_METHODS[option])(mf=morph_feats, encode=True, out=out)
+        assert X.shape[1] == len(column2mapping[conf])
+        Y = np.array([bio.get(b, 0) for b in self.list_bios()], dtype=np.int32)
+        return X, Y
+
+    def encode_superset(self, out=None):
+        """Encodes every column in mappings.superset_columns at once, so that any
+        configuration is a selection of columns (mappings.column2superset).
+        out: optional preallocated int array of shape (n_tokens, len(superset_columns)).
+        Returns (X, Y) as encode()."""
+        st = self.structure(2)
+        ids = st['ids']
+        pos, rel = self._tables(True)
+        head = st['head'][ids]
+        grand = st['anc'][2, ids]
+        lchild, rchild = st['lchild'][ids], st['rchild'][ids]
+        prev_is_head = ids - head == 1
+        next_is_head = head - ids == 1
+        columns = [pos[ids],
+                   self._bools(prev_is_head, True), self._bools(next_is_head, True),
+                   np.where(prev_is_head, rel[ids], rel[0]), np.where(next_is_head, rel[ids], rel[0]),
+                   rel[ids], pos[head], rel[head], pos[grand],
+                   rel[lchild], pos[lchild], rel[rchild], pos[rchild]]
+        X = self._emit(columns, True, True, out)
+        assert X.shape[1] == len(superset_columns)
+        Y = np.array([bio.get(b, 0) for b in self.list_bios()], dtype=np.int32)
+        return X, Y
+
+    def _morph_ids(self):
+        """Same as _morph_rows() but with mapping ids, shape (n_tokens, 8)."""
+        if self.compact:
+            feats = self._feats[1:]
+        else:
+            feats = [tok.feats for tok in self.tokens.values()]
+        return np.array([encode_feats(f) for f in feats], dtype=np.int32)
+
+    def _morph_rows(self):
+        """Morph features of every token, in order. Kept for the next call."""
+        if self._morph is None:
+            self._morph = [tok._get_mf() for tok in self.tokens.values()]
+        return self._morph
+
+    def _format_rows(self, columns, mf):
+        """Puts together TSV lines from feature columns (arrays over tokens in order).
+        Morph features go right after the first column if mf is True,
+        the BIO label always goes last."""
+        rows = zip(*columns)
+        if mf:
+            rows = ((first, *morph, *rest)
+                    for morph, (first, *rest) in zip(self._morph_rows(), rows))
+        lines = ['\t'.join(row) + '\t{}\n'.format(bnp)
+                 for row, bnp in zip(rows, self.list_bios())]
+        return ''.join(lines) + '\n'
 
     def __repr__(self):
         repr = ''
@@ -641,3 +703,302 @@ class Tree:
             repr += i.form
             repr += ' '
         return repr
+
+
+def load_bnps(trees, phrase_lists, stats=None):
+    """Batch version of Tree.load_bnp() over a whole treebank.
+    trees: iterable of Trees not yet marked, eg. from read_trees();
+    phrase_lists: iterable of the matching lists of phrases.
+    Yields every tree once it is marked. If a dict is given as `stats', it is
+    updated with the numbers of sentences, perfectly marked sentences, phrases,
+    phrase words, marked phrases and marked words."""
+    if stats is None:
+        stats = {}
+    for k in ('sentences', 'perfect', 'phrases', 'words', 'marked_phrases', 'marked_words'):
+        stats.setdefault(k, 0)
+    for tree, phrases in zip(trees, phrase_lists):
+        assert tree.bnp_marked == False
+        ph_count, phw_count, b_count, bw_count = tree._align_bnp(phrases)
+        stats['sentences'] += 1
+        stats['perfect'] += (ph_count == b_count and phw_count == bw_count)
+        stats['phrases'] += ph_count
+        stats['words'] += phw_count
+        stats['marked_phrases'] += b_count
+        stats['marked_words'] += bw_count
+        yield tree
+
+def split_conf(conf):
+    """Splits a configuration name into the option of Tree.output_nnfeats()
+    and whether morph features are on, eg. 'pos_dep_morph' -> ('pos_dep', True)."""
+    if conf.endswith('_morph'):
+        return conf[:-len('_morph')], True
+    return conf, False
+
+def _block_sent_id(block):
+    """Returns the value of the `# sent_id' comment in a block of lines,
+    or None if the block has no such comment."""
+    for l in block:
+        if l.startswith('# sent_id'):
+            return l.split('=', 1)[-1].strip()
+        if not l.startswith('#'):
+            # Comments come before the token lines.
+            break
+    return None
+
+def read_blocks(fin, sent_ids=None):
+    """Yields sentence blocks (str) one at a time from an open file.
+    fin: a file handle, CoNLL-U or NN input TSV. Sentences are separated by blank lines.
+    sent_ids: optional collection of `# sent_id' values. If given, only those
+        sentences are yielded.
+    Only one sentence is kept in memory at a time, so this works on full UD releases
+    and lets the caller start working before the whole file is read."""
+    if sent_ids is not None:
+        sent_ids = set(sent_ids)
+    block = []
+    for line in fin:
+        if line.strip():
+            block.append(line)
+            continue
+        if block:
+            if sent_ids is None or _block_sent_id(block) in sent_ids:
+                yield ''.join(block)
+            block = []
+    if block:
+        if sent_ids is None or _block_sent_id(block) in sent_ids:
+            yield ''.join(block)
+
+def read_trees(fin, bnp_marked=False, sent_ids=None, compact=False):
+    """Same as read_blocks() but yields a Tree for every sentence."""
+    for block in read_blocks(fin, sent_ids):
+        yield Tree(block, bnp_marked=bnp_marked, compact=compact)
+
+
+class _Vocab:
+    """Corpus-wide string <-> id table, shared by all compact Trees.
+    Seeded with a mapping from mappings.py so that known values keep their ids there;
+    unseen values (eg. deprels with subtypes) are appended. Trees are built in the
+    producer threads of PrefetchBatches too, so growing the table takes a lock."""
+
+    def __init__(self, seed):
+        self.ids = {}
+        self.strings = []
+        self._lock = threading.Lock()
+        for k in sorted(seed, key=seed.get):
+            self.index(k)
+        self._mapped = {}
+
+    def to_mapping(self, mapping):
+        """Array that turns ids of this vocabulary into ids of `mapping' as
+        map_value() does, with -1 where map_value() raises a KeyError."""
+        key = id(mapping)
+        with self._lock:
+            if key not in self._mapped or len(self._mapped[key]) < len(self.strings):
+                self._mapped[key] = _map_ids(mapping, self.strings)
+            return self._mapped[key]
+
+    def index(self, string):
+        i = self.ids.get(string)
+        if i is None:
+            with self._lock:
+                # Another thread may have added it since the lookup above.
+                i = self.ids.get(string)
+                if i is None:
+                    i = len(self.strings)
+                    self.strings.append(sys.intern(string))
+                    self.ids[string] = i
+        return i
+
+_UPOS = _Vocab(pos2idx)
+_DEPREL = _Vocab(rel2idx)
+
+
+class _ColumnToken:
+    """Behaves like Tree.Token but reads (and for `bnp', writes) the columns
+    of a compact Tree. Created on the fly and not stored."""
+
+    __slots__ = ('_tree', 'idx')
+
+    def __init__(self, tree, idx):
+        self._tree = tree
+        self.idx = idx
+
+    form = property(lambda self: self._tree._form[self.idx])
+    lemma = property(lambda self: self._tree._lemma[self.idx])
+    pos = property(lambda self: _UPOS.strings[self._tree._upos[self.idx]])
+    xpos = property(lambda self: self._tree._xpos[self.idx])
+    feats = property(lambda self: self._tree._feats[self.idx])
+    head = property(lambda self: int(self._tree._head[self.idx]))
+    rel = property(lambda self: _DEPREL.strings[self._tree._deprel[self.idx]])
+    deps = property(lambda self: self._tree._deps[self.idx])
+    misc = property(lambda self: self._tree._misc[self.idx])
+
+    @property
+    def bnp(self):
+        return self._tree._bnp[self.idx]
+
+    @bnp.setter
+    def bnp(self, value):
+        self._tree._bnp[self.idx] = value
+
+    _get_mf = Tree.Token._get_mf
+    is_dep_prev = Tree.Token.is_dep_prev
+    is_dep_next = Tree.Token.is_dep_next
+    __repr__ = Tree.Token.__repr__
+
+
+class _TokenTable(Mapping):
+    """Stands in for the `tokens' dict of a compact Tree: token ID -> token."""
+
+    def __init__(self, tree):
+        self._tree = tree
+
+    def __getitem__(self, k):
+        if not 1 <= k < len(self._tree._form):
+            raise KeyError(k)
+        return _ColumnToken(self._tree, k)
+
+    def __iter__(self):
+        return iter(range(1, len(self._tree._form)))
+
+    def __len__(self):
+        return len(self._tree._form) - 1
+
+
+class _ChildTable(Mapping):
+    """Stands in for the `children' defaultdict of a compact Tree:
+    head ID -> list of dependent IDs, [] for tokens without dependents."""
+
+    def __init__(self, heads):
+        # Dependents grouped by head, in token order.
+        self._order = np.argsort(heads[1:], kind='stable') + 1
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(heads[1:], minlength=len(heads)))))
+
+    def __getitem__(self, k):
+        if not 0 <= k < len(self._offsets) - 1:
+            return []
+        return self._order[self._offsets[k]:self._offsets[k+1]].tolist()
+
+    def __iter__(self):
+        return (k for k in range(len(self._offsets) - 1) if self._offsets[k] != self._offsets[k+1])
+
+    def __len__(self):
+        return int(np.count_nonzero(np.diff(self._offsets)))
+
+
+def build_index(path):
+    """Writes the sidecar index `<path>.idx' of a CoNLL-U file and returns its entries.
+    The first line records the size and mtime of the treebank, so a stale index can
+    be told apart. Then one line per sentence block, in order:
+        byte offset <TAB> length in bytes <TAB> sent_id (or _)"""
+    entries = []
+    offset = 0
+    start = None
+    sent_id = None
+    with open(path, 'rb') as fin:
+        for line in fin:
+            if line.strip():
+                if start is None:
+                    start = offset
+                    sent_id = None
+                if sent_id is None and line.startswith(b'# sent_id'):
+                    sent_id = line.split(b'=', 1)[-1].strip().decode('utf-8')
+            elif start is not None:
+                entries.append((start, offset - start, sent_id))
+                start = None
+            offset += len(line)
+    if start is not None:
+        entries.append((start, offset - start, sent_id))
+
+    st = os.stat(path)
+    # Written under a temporary name and renamed, so that a reader in another
+    # process (eg. a sweep.py worker) never sees a half-written index.
+    tmp = path + '.idx.tmp{}'.format(os.getpid())
+    try:
+        with open(tmp, 'w') as fout:
+            fout.write('# {}\t{}\n'.format(st.st_size, st.st_mtime_ns))
+            for start, length, sent_id in entries:
+                fout.write('{}\t{}\t{}\n'.format(start, length, sent_id or '_'))
+        os.replace(tmp, path + '.idx')
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return entries
+
+def list_shards(dirpath):
+    """Sorted names of the treebank files in `dirpath', leaving out the sidecar
+    indexes of build_index() (and their temporary files)."""
+    return sorted(fn for fn in os.listdir(dirpath) if not fn.endswith('.idx') and '.idx.tmp' not in fn)
+
+def _read_index(path):
+    """Entries of the sidecar index of `path', or None if it is missing or stale."""
+    try:
+        with open(path + '.idx', 'r') as fin:
+            header = fin.readline()
+            st = os.stat(path)
+            if header != '# {}\t{}\n'.format(st.st_size, st.st_mtime_ns):
+                return None
+            entries = []
+            for line in fin:
+                start, length, sent_id = line.rstrip('\n').split('\t')
+                entries.append((int(start), int(length), None if sent_id == '_' else sent_id))
+            return entries
+    except FileNotFoundError:
+        return None
+
+
+class TreebankIndex:
+
+    """Random access to the sentences of a large CoNLL-U file.
+    The file is memory-mapped and the sidecar index from build_index() (built or
+    rebuilt when needed) gives the byte offset of every sentence, so getting one
+    sentence is a seek instead of a read of the whole file.
+
+        with TreebankIndex(ENSECTION + 'original/testset.txt', bnp_marked=True) as tb:
+            tree = tb[1234]               # by ordinal, 0-based
+            tree = tb.by_sent_id('s5')    # by `# sent_id'
+    """
+
+    def __init__(self, path, bnp_marked=False, compact=False):
+        self.path = path
+        self.bnp_marked = bnp_marked
+        self.compact = compact
+        self.entries = _read_index(path)
+        if self.entries is None:
+            self.entries = build_index(path)
+        self.sent_ids = {sent_id: i for i, (_, _, sent_id) in enumerate(self.entries) if sent_id is not None}
+
+        self._file = open(path, 'rb')
+        # mmap refuses empty files.
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.entries else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def block(self, i):
+        """Text of sentence i."""
+        start, length, _ = self.entries[i]
+        return self._map[start:start+length].decode('utf-8')
+
+    def tree(self, i):
+        return Tree(self.block(i), bnp_marked=self.bnp_marked, compact=self.compact)
+
+    def by_sent_id(self, sent_id):
+        return self.tree(self.sent_ids[sent_id])
+
+    def __getitem__(self, k):
+        return self.by_sent_id(k) if isinstance(k, str) else self.tree(k)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.tree(i)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,172 @@
+import json
+import os
+import sys
+from collections import Counter
+from mappings import column2mapping, column2superset, superset_columns, pos2idx, rel2idx
+from conllu import read_trees, read_blocks, list_shards, parse_feats, MORPH_FEATS, MORPH_MAPPINGS
+
+# Sentences whose length MAXLEN should cover, see padding_plan().
+COVERAGE = 0.99
+N_BUCKETS = 6
+
+class CorpusStats:
+
+    """Statistics over BIO-marked CoNLL-U shards, or over the NN input files of a
+    configuration, gathered in one streaming pass:
+    sentence lengths, BIO labels, and for every column the counts of its values
+    and how many of them are missing from the mapping in mappings.py (OOV).
+
+        stats = CorpusStats()
+        with open('data/english/original/0.txt') as fin:
+            for tree in read_trees(fin, bnp_marked=True, compact=True):
+                stats.add_tree(tree)
+        stats.save('data/english/corpus_stats.json')
+    """
+
+    def __init__(self):
+        self.lengths = Counter()
+        self.labels = Counter()
+        self.columns = {}
+        self.mappings = {}
+        self.files = []
+
+    def _column(self, name, mapping):
+        if name not in self.columns:
+            self.columns[name] = Counter()
+            self.mappings[name] = mapping
+        return self.columns[name]
+
+    def add_tree(self, tree):
+        """One sentence of a CoNLL-U shard: UPOS, deprel and morph features."""
+        if not len(tree):
+            return
+        self.lengths[len(tree)] += 1
+        self.labels.update(tree.list_bios())
+        upos = self._column('upos', pos2idx)
+        deprel = self._column('deprel', rel2idx)
+        morph = [self._column(feat, mapping) for feat, mapping in zip(MORPH_FEATS, MORPH_MAPPINGS)]
+        for tok in tree.tokens.values():
+            upos[tok.pos] += 1
+            deprel[tok.rel] += 1
+            for counts, value in zip(morph, parse_feats(tok.feats)):
+                counts[value] += 1
+
+    def add_block(self, block, conf):
+        """One sentence of an NN input file of `conf'."""
+        names = [superset_columns[j] for j in column2superset[conf]]
+        columns = [self._column(name, mapping) for name, mapping in zip(names, column2mapping[conf])]
+        rows = [l.split('\t') for l in block.split('\n') if l and not l.startswith('#')]
+        if not rows:
+            return
+        self.lengths[len(rows)] += 1
+        for row in rows:
+            for counts, value in zip(columns, row):
+                counts[value] += 1
+            self.labels[row[-1]] += 1
+
+    def report(self, coverage=COVERAGE, n_buckets=N_BUCKETS):
+        n_sents = sum(self.lengths.values())
+        n_tokens = sum(l * c for l, c in self.lengths.items())
+        columns = {}
+        for name, counts in self.columns.items():
+            mapping = self.mappings[name]
+            # Values with subtypes (`feat:subtype') go with their main type, as in the loaders.
+            oov = {v: c for v, c in counts.items() if v not in mapping and v.split(':')[0] not in mapping}
+            columns[name] = {'counts': dict(counts.most_common()), 'oov': oov,
+                             'oov_rate': sum(oov.values()) / n_tokens if n_tokens else 0.0,
+                             'unused': [k for k in mapping if k not in counts and k not in ('_', 'OOV')]}
+        return {'files': self.files,
+                'sentences': n_sents,
+                'tokens': n_tokens,
+                'lengths': {str(l): self.lengths[l] for l in sorted(self.lengths)},
+                'length_percentiles': {str(p): _percentile(self.lengths, p) for p in (50, 90, 95, 99, 100)},
+                'labels': dict(self.labels.most_common()),
+                'columns': columns,
+                'plan': padding_plan(self.lengths, coverage, n_buckets)}
+
+    def save(self, path, coverage=COVERAGE, n_buckets=N_BUCKETS):
+        """Writes report() to `path' as JSON and returns it."""
+        report = self.report(coverage, n_buckets)
+        with open(path, 'w') as fout:
+            json.dump(report, fout, indent=1)
+        return report
+
+
+def _percentile(lengths, p):
+    """Smallest length such that p% of the sentences are no longer."""
+    total = sum(lengths.values())
+    seen = 0
+    for l in sorted(lengths):
+        seen += lengths[l]
+        if seen * 100 >= p * total:
+            return l
+    return 0
+
+def padding_plan(lengths, coverage=COVERAGE, n_buckets=N_BUCKETS):
+    """Picks MAXLEN as the length that covers `coverage' of the sentences, and the
+    bucket edges (at most n_buckets, the last one MAXLEN) that minimize the number of
+    padding positions, given a Counter of sentence lengths.
+    Sentences longer than MAXLEN count as MAXLEN, as they are truncated or windowed."""
+    if not lengths:
+        return {'coverage': coverage, 'maxlen': 0, 'buckets': [], 'padding': 0, 'padding_fixed': 0}
+    maxlen = _percentile(lengths, coverage * 100)
+    count = [0] * (maxlen + 1)
+    for l, c in lengths.items():
+        count[min(l, maxlen)] += c
+    # Prefix sums of sentences and tokens, so that the padding of a bucket (a, e]
+    # is e * sentences - tokens.
+    C = [0] * (maxlen + 1)
+    S = [0] * (maxlen + 1)
+    for l in range(1, maxlen + 1):
+        C[l] = C[l-1] + count[l]
+        S[l] = S[l-1] + l * count[l]
+    pad = lambda a, e: e * (C[e] - C[a]) - (S[e] - S[a])
+
+    # best[k][e]: least padding of lengths up to e with k buckets, the last ending at e.
+    INF = float('inf')
+    best = [[INF] * (maxlen + 1) for _ in range(n_buckets + 1)]
+    back = [[0] * (maxlen + 1) for _ in range(n_buckets + 1)]
+    best[0][0] = 0
+    for k in range(1, n_buckets + 1):
+        for e in range(1, maxlen + 1):
+            for a in range(e):
+                cost = best[k-1][a] + pad(a, e)
+                if cost < best[k][e]:
+                    best[k][e], back[k][e] = cost, a
+    k = min(range(1, n_buckets + 1), key=lambda k: best[k][maxlen])
+    buckets = []
+    e = maxlen
+    while k:
+        buckets.append(e)
+        e = back[k][e]
+        k -= 1
+    return {'coverage': coverage, 'maxlen': maxlen, 'buckets': sorted(buckets),
+            'padding': best[len(buckets)][maxlen], 'padding_fixed': pad(0, maxlen)}
+
+def collect(langdir, filenames=None, conf=None):
+    """CorpusStats of the shards `langdir/original/<fn>', or of the NN input files
+    `langdir/<conf>/<fn>' if conf is given. filenames: all files by default."""
+    srcdir = os.path.join(langdir, conf or 'original')
+    if filenames is None:
+        filenames = list_shards(srcdir)
+    stats = CorpusStats()
+    for fn in filenames:
+        path = os.path.join(srcdir, fn)
+        stats.files.append(path)
+        with open(path, 'r') as fin:
+            if conf:
+                for block in read_blocks(fin):
+                    stats.add_block(block, conf)
+            else:
+                for tree in read_trees(fin, bnp_marked=True, compact=True):
+                    stats.add_tree(tree)
+    return stats
+
+if __name__ == '__main__':
+    # python corpus_stats.py data/english [0.txt 1.txt ...]
+    # Writes data/english/corpus_stats.json, see helpers.read_padding_plan().
+    stats = collect(sys.argv[1], sys.argv[2:] or None)
+    out = os.path.join(sys.argv[1], 'corpus_stats.json')
+    plan = stats.save(out)['plan']
+    print('{}: MAXLEN {}, buckets {}, padding {} positions ({} with MAXLEN only)'.format(
+        out, plan['maxlen'], plan['buckets'], plan['padding'], plan['padding_fixed']))
@@ -1,9 +1,146 @@
-from keras.utils import to_categorical
-from keras.preprocessing import sequence
-from keras import backend as K
+# Keras is imported where it is used, so that importing helpers does not
+# import Keras and TensorFlow, eg. in predict.py with npinfer.py models.
+# The Keras classes used in training are in training.py.
 import numpy as np
 from mappings import *
+from conllu import read_trees, TreebankIndex, map_value
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import hashlib
+import inspect
+import json
 import os
+import queue
+import random
+import shutil
+import threading
+import time
+import tracemalloc
+
+ENDIR = '/Users/tonghe/PROG/ThesisRepositoryOfTW/data/english/'
+FRDIR = '/Users/tonghe/PROG/ThesisRepositoryOfTW/data/french/'
+
+# Encoded shards are cached here, see _cached_load().
+CACHEDIR = '/Users/tonghe/PROG/ThesisRepositoryOfTW/data/cache/'
+CACHE_VERSION = 3 # Bump when the encoding itself changes.
+
+# In-process budget of load_data_cached(), in bytes.
+DATASET_CACHE_BYTES = 2 * 1024**3
+
+# Default upper bounds of sentence lengths for BucketedSequence.
+BUCKETS = [10, 20, 30, 40, 60, 80]
+
+# Loader profiling, see enable_profiling(). Off by default.
+PROFILES = [] # Reports of profiled loader calls
+_profiling = None # Settings while enabled: {'report_dir': ..., 'memory': ...}
+_profiles = threading.local() # .report: the loader call being profiled in this thread
+
+def enable_profiling(report_dir=None, memory=True):
+    """Profiles every call of the public loaders (load_data_from_files() etc.): wall time
+    of each stage, sentences/s, tokens/s and, with memory=True, peak bytes allocated
+    (tracemalloc). Reports are added to PROFILES and, if report_dir is given, each is
+    saved there as JSON. See profile_summary()."""
+    global _profiling
+    _profiling = {'report_dir': report_dir, 'memory': memory}
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable_profiling():
+    global _profiling
+    if _profiling and _profiling['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _profiling = None
+
+def _current_profile():
+    """Report of the loader call being profiled in this thread, or None. Stages run
+    in other threads (eg. by PrefetchBatches) are not part of it."""
+    return getattr(_profiles, 'report', None)
+
+def _reset_peak():
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # No reset_peak() before Python 3.9; restarting clears the peak too.
+        tracemalloc.stop()
+        tracemalloc.start()
+
+@contextmanager
+def _stage(name):
+    """Adds the time (and peak memory) spent in the block to stage `name' of the
+    current profile; does nothing when not profiling. Stages do not nest."""
+    profile = _current_profile()
+    if profile is None:
+        yield
+        return
+    memory = tracemalloc.is_tracing()
+    if memory:
+        _reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        st = profile['stages'].setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_bytes': 0})
+        st['seconds'] += time.perf_counter() - started
+        st['calls'] += 1
+        if memory:
+            st['peak_bytes'] = max(st['peak_bytes'], tracemalloc.get_traced_memory()[1] - before)
+
+def _count(sentences, tokens):
+    """Records the size of the data loaded by the call being profiled."""
+    profile = _current_profile()
+    if profile is not None:
+        profile['sentences'] += int(sentences)
+        profile['tokens'] += int(tokens)
+
+def _profiled(loader):
+    """Profiles calls of `loader' while profiling is enabled. Calls made by another
+    profiled loader are part of the caller's report."""
+    params = inspect.signature(loader)
+
+    @functools.wraps(loader)
+    def wrapper(*args, **kwargs):
+        if _profiling is None or _current_profile() is not None:
+            return loader(*args, **kwargs)
+        call = params.bind(*args, **kwargs).arguments
+        conf = call.get('conf', 'superset')
+        target_lang = call['target_lang']
+        report = _profiles.report = {'loader': loader.__name__, 'conf': conf, 'lang': target_lang,
+                                     'files': list(call['files']), 'seq_len': call['seq_len'],
+                                     'sentences': 0, 'tokens': 0, 'stages': {}}
+        started = time.perf_counter()
+        try:
+            return loader(*args, **kwargs)
+        finally:
+            _profiles.report = None
+            report['seconds'] = time.perf_counter() - started
+            for st in report['stages'].values():
+                st['sents_per_sec'] = report['sentences'] / st['seconds'] if st['seconds'] else 0.0
+                st['tokens_per_sec'] = report['tokens'] / st['seconds'] if st['seconds'] else 0.0
+            report['peak_bytes'] = max([st['peak_bytes'] for st in report['stages'].values()] or [0])
+            PROFILES.append(report)
+            if _profiling['report_dir']:
+                os.makedirs(_profiling['report_dir'], exist_ok=True)
+                fn = '{}_{}_{}_{}.json'.format(len(PROFILES), report['loader'], conf, target_lang)
+                with open(os.path.join(_profiling['report_dir'], fn), 'w') as fout:
+                    json.dump(report, fout, indent=1)
+    return wrapper
+
+def profile_summary(profiles=None):
+    """A table of the stages of profiled loader calls (PROFILES by default)."""
+    lines = ['{:<24} {:<28} {:<4} {:<12} {:>8} {:>10} {:>11} {:>9}'.format(
+        'loader', 'conf', 'lang', 'stage', 'seconds', 'sents/s', 'tokens/s', 'peak MB')]
+    for report in PROFILES if profiles is None else profiles:
+        stages = sorted(report['stages'].items(), key=lambda item: -item[1]['seconds'])
+        stages.append(('total', {'seconds': report['seconds'], 'peak_bytes': report['peak_bytes'],
+                                 'sents_per_sec': report['sentences'] / report['seconds'] if report['seconds'] else 0.0,
+                                 'tokens_per_sec': report['tokens'] / report['seconds'] if report['seconds'] else 0.0}))
+        for name, st in stages:
+            lines.append('{:<24} {:<28} {:<4} {:<12} {:>8.3f} {:>10.0f} {:>11.0f} {:>9.1f}'.format(
+                report['loader'], report['conf'], report['lang'], name, st['seconds'],
+                st['sents_per_sec'], st['tokens_per_sec'], st['peak_bytes'] / 2**20))
+    return '\n'.join(lines)
 
 def _make_array(sent, mapping):
     """
@@ -31,10 +168,8 @@ def _make_array(sent, mapping):
             continue
 
         for j in range(len(feats)):
-            this_feat = feats[j]
-            if ':' in this_feat:
-                this_feat = this_feat.split(':')[0]
-            X_arr[i, j] = mapping[j][this_feat]
+            # Subtypes go with their main type, unknown values get OOV, see map_value().
+            X_arr[i, j] = map_value(mapping[j], feats[j])
 
         # Code below handles labels
         # Y_arr[i, 0] = bio[label]
@@ -42,48 +177,132 @@ def _make_array(sent, mapping):
 
     return (X_arr, Y_list)
 
-def _pad_feats_seq(sent_feats, seq_len, num_columns):
+def _lookup_table(mapping, values):
+    """String -> id table for one column. Starts as a copy of `mapping' and
+    learns the other values as they are seen: values with subtypes (`feat:subtype')
+    and, in morph columns, unknown values, see map_value()."""
+    key = id(mapping)
+    if key not in _lookup_tables:
+        _lookup_tables[key] = dict(mapping)
+    table = _lookup_tables[key]
+    for v in values.difference(table):
+        table[v] = map_value(mapping, v)
+    return table
+
+_lookup_tables = {}
+
+def _encode_shard(text, mapping):
+    """Vectorized _make_array() for a whole shard of NN input at once.
+    text: str. Contents of an NN input file, sentences separated by blank lines.
+    mapping: list of mappings, one per feature column, eg. column2mapping[conf].
+    Returns (X, Y, offsets): X the ids of all tokens in the shard, shape (n_tokens, n_columns);
+    Y their label ids; sentence i is X[offsets[i]:offsets[i+1]].
+    The shard is split into cells in one go, and every column goes through a
+    precompiled string -> id table with map(), without a Python loop over cells."""
+    with _stage('split'):
+        rows = []
+        lengths = []
+        for block in text.split('\n\n'):
+            if block.strip():
+                lines = [l for l in block.split('\n') if l and not l.startswith('#')]
+                rows.extend(lines)
+                lengths.append(len(lines))
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+        n_tokens = len(rows)
+        width = len(mapping) + 1 # Label in the last column
+        cells = '\t'.join(rows).split('\t') if rows else []
+        if len(cells) != n_tokens * width:
+            raise ValueError('Expected {} columns on every line'.format(width))
+
+    with _stage('lookup'):
+        X = np.zeros((n_tokens, len(mapping)), dtype=np.int32)
+        for j in range(len(mapping)):
+            column = cells[j::width]
+            table = _lookup_table(mapping[j], set(column))
+            X[:, j] = np.fromiter(map(table.__getitem__, column), dtype=np.int32, count=n_tokens)
+        Y = np.fromiter(map(bio.__getitem__, cells[width-1::width]), dtype=np.int32, count=n_tokens)
+    return X, Y, offsets
+
+def _ids_dtype(mapping):
+    """Smallest unsigned int type that holds every id of a list of mappings.
+    All mappings in mappings.py have fewer than 256 ids, so this is uint8."""
+    top = max(max(m.values()) for m in mapping)
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def _pad_flat(X, offsets, seq_len, dtype):
+    """Pads and truncates sentences held back to back in X (sentence i is
+    X[offsets[i]:offsets[i+1]]) into one array of shape (n_sents, seq_len, ...),
+    allocated once and filled in a single fancy-indexed assignment.
+    As with pad_sequences(padding='post'), padding goes at the end and
+    sentences longer than seq_len keep their last seq_len tokens."""
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    out = np.zeros((len(lengths), seq_len) + X.shape[1:], dtype=dtype)
+    sent = np.repeat(np.arange(len(lengths)), lengths)
+    # Position of each token in its padded row; negative for cut-off tokens.
+    position = np.arange(len(X)) - offsets[:-1][sent] - np.maximum(lengths - seq_len, 0)[sent]
+    keep = position >= 0
+    out[sent[keep], position[keep]] = X[keep]
+    return out
+
+def _pad_feats_seq(sent_feats, seq_len, num_columns, dtype=None):
     """sent_feats: a series of sentence features, output from _make_array().
     - Note _make_array() handles single sentences.
     columns: number of columns in sentence features
-    seq_len: arbitrary number that indicates the max length of sequence"""
-    # The trick for the two functions to work is:
-    # __make_array() outputs one sentence
-    # I suppose `sent_feats` in this function means a lot of sents with their feats.
-    
-    #print(sent_feats)
-    seqs = []
-    # print(num_columns)
-    for i in range(0, num_columns):
-        seq = []
-        #print(i)
-        for sent in sent_feats:
-            #print(sent)
-            #single_feat = sent[i]
-            #single_feat = sent[,:,i]
-            single_feat = sent[:,i]
-            # print(single_feat)
-            seq.append(single_feat)
-        seqs.append(seq)
-    
-    # Why did I use yield earlier?
-    # Confused.
-    # print("Inside _pad_feats_seq. len(seqs)")
-    # print(len(seqs))
-    # print("seqs")
-    # print(seqs)
-    output = [sequence.pad_sequences(seq, maxlen = seq_len, padding='post') for seq in seqs]
-    # print("Output from _pad_feats_seq. len(seqs)")
-    # print(output)
-    return output
-
-
-def make_labels(labels, seq_len):
+    seq_len: arbitrary number that indicates the max length of sequence
+    dtype: of the output, int32 by default. See _ids_dtype().
+    Returns one (n_sents, seq_len) array per column, which are all views
+    into a single (n_sents, seq_len, num_columns) array."""
+    lengths = [len(sent) for sent in sent_feats]
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+    X = np.concatenate(sent_feats) if sent_feats else np.zeros((0, num_columns), dtype=np.int32)
+    return _pad_columns(X, offsets, seq_len, dtype or np.int32)
+
+def column_offsets(mapping):
+    """Where the ids of each column start in one table shared by all columns
+    (see pack_columns()), and the size of that table."""
+    sizes = [max(m.values()) + 1 for m in mapping]
+    return np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64), int(sum(sizes))
+
+def pack_columns(X_seqs, mapping):
+    """Packs the columns of X_seqs into a single (n_sents, seq_len, n_columns) array
+    for a model with one fused embedding, shifting the ids of every column by its
+    offset in the fused table, see column_offsets()."""
+    offsets, size = column_offsets(mapping)
+    dtype = np.uint8 if size <= 256 else np.uint16 if size <= 65536 else np.int32
+    packed = np.empty(X_seqs[0].shape + (len(X_seqs),), dtype=dtype)
+    for j, X in enumerate(X_seqs):
+        np.add(X, offsets[j], out=packed[..., j], casting='unsafe')
+    return packed
+
+def _pad_columns(X, offsets, seq_len, dtype):
+    """_pad_flat() for feature matrices: the padded 3-D array as column views."""
+    with _stage('pad'):
+        X3 = _pad_flat(X, offsets, seq_len, dtype)
+    return [X3[:, :, j] for j in range(X3.shape[2])]
+
+def make_labels(labels, seq_len, sparse=False):
     """labels is an input list that contains Y_list from multiple sents.
-    Note: _make_array() handles and outputs a single sent."""
+    Note: _make_array() handles and outputs a single sent.
+    sparse: if True, labels are kept as uint8 ids of shape (n_sents, seq_len)
+        (for sparse_categorical_crossentropy) instead of being one-hot encoded."""
+
+    lengths = [len(sent) for sent in labels]
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+    Y = np.concatenate([np.asarray(sent, dtype=np.int32) for sent in labels]) if labels else np.zeros(0, dtype=np.int32)
+    return _labels_from_flat(Y, offsets, seq_len, sparse)
 
-    labels_seq = sequence.pad_sequences(labels, maxlen = seq_len, padding="post")
-    return to_categorical(labels_seq, num_classes=len(bio), dtype='int32')
+def _labels_from_flat(Y, offsets, seq_len, sparse=False):
+    with _stage('labels'):
+        if sparse:
+            return _pad_flat(Y, offsets, seq_len, np.uint8)
+        labels_seq = _pad_flat(Y, offsets, seq_len, np.int32)
+        # Same as keras.utils.to_categorical(labels_seq, len(bio), dtype='int32')
+        return np.eye(len(bio), dtype=np.int32)[labels_seq]
 
 
 def ignore_accuracy(y_true, y_pred):
@@ -97,6 +316,7 @@ def ignore_accuracy(y_true, y_pred):
     
     # Also, if loading models fail, try this:
     # model = load_model('mymodel.h5', custom_objects={'ignore_accuracy':ignore_accuracy})
+    from keras import backend as K
     to_ignore = 0 # Ignore the correctly predicted paddings.
     y_true_class = K.argmax(y_true, axis=-1)
     y_pred_class = K.argmax(y_pred, axis=-1)
@@ -106,59 +326,579 @@ def ignore_accuracy(y_true, y_pred):
     accuracy = K.sum(matches) / K.maximum(K.sum(ignore_mask), 1)
     return accuracy
 
-def load_data_from_files(seq_len, conf, target_lang, files: list):
+def ignore_accuracy_sparse(y_true, y_pred):
+    """ignore_accuracy() for sparse labels (see make_labels()), to go with
+    loss='sparse_categorical_crossentropy'. The labels are already ids, no
+    argmax over them is needed. Masks the same positions as ignore_accuracy()
+    (predicted padding), so both report the same metric in acc.txt.
+    When loading models: custom_objects={'ignore_accuracy_sparse': ignore_accuracy_sparse}"""
+    from keras import backend as K
+    to_ignore = 0 # Ignore the correctly predicted paddings.
+    y_true_class = K.cast(K.reshape(y_true, K.shape(y_pred)[:-1]), 'int64')
+    y_pred_class = K.argmax(y_pred, axis=-1)
+
+    ignore_mask = K.cast(K.not_equal(y_pred_class, to_ignore), 'int32')
+    matches = K.cast(K.equal(y_true_class, y_pred_class), 'int32') * ignore_mask
+    accuracy = K.sum(matches) / K.maximum(K.sum(ignore_mask), 1)
+    return accuracy
+
+def _shard_filenames(files):
+    """files: indices of shards, -1 for the test set."""
+    if -1 in files:
+        return ['testset.txt']
+    return [str(i)+'.txt' for i in files]
+
+def _shard_paths(subdir, target_lang, files):
+    """Paths of shard files under `<lang dir>/<subdir>/`, in loading order."""
+    paths = []
+    for fn in _shard_filenames(files):
+        if target_lang == 'en' or target_lang == 'both':
+            paths.append(ENDIR+subdir+'/'+fn)
+        if target_lang == 'fr' or target_lang == 'both':
+            paths.append(FRDIR+subdir+'/'+fn)
+    return paths
+
+def sequence_lengths(Y_seqs):
+    """Number of real (non-padding) tokens of each sentence in padded labels."""
+    Y_seqs = np.asarray(Y_seqs)
+    if Y_seqs.ndim == 3:
+        Y_seqs = Y_seqs.argmax(axis=-1)
+    return np.count_nonzero(Y_seqs, axis=1)
+
+def read_padding_plan(path, maxlen=80, buckets=BUCKETS):
+    """MAXLEN and bucket edges from the `plan' of a corpus_stats.py artifact,
+    chosen there to cover most sentences with the least padding.
+    Returns (maxlen, buckets) as given if there is no such file."""
+    if not path or not os.path.exists(path):
+        return maxlen, list(buckets)
+    with open(path, 'r') as fin:
+        plan = json.load(fin)['plan']
+    return plan['maxlen'], plan['buckets']
+
+def _bucket_of(lengths, buckets):
+    """Index of the smallest bucket each length fits in. Lengths over the
+    largest bucket go into it, as they are truncated anyway."""
+    return np.minimum(np.searchsorted(buckets, lengths), len(buckets)-1)
+
+def input_shape(model, i=0):
+    """Shape of input i of a Keras model or of an npinfer.NumpyModel."""
+    if hasattr(model, 'input_shapes'):
+        return model.input_shapes[i]
+    from keras import backend as K
+    return K.int_shape(model.inputs[i])
+
+def model_inputs(model, X_seqs, conf):
+    """X_seqs as `model' takes them: packed (see pack_columns()) if it has one input
+    with a column axis, ie. a fused embedding; as they are otherwise."""
+    if len(model.inputs) == 1 and len(input_shape(model)) == 3:
+        return [pack_columns(X_seqs, column2mapping[conf])]
+    return X_seqs
+
+def predict_bucketed(model, X_seqs, lengths, batch_size, buckets=BUCKETS):
+    """model.predict() over length buckets, each batch cut to its bucket as in
+    BucketedSequence. Positions past each bucket are left as zeros, ie. padding.
+    This is not the same output as predicting on the padded X_seqs: nothing masks
+    the padding, so the backward RNN goes over fewer padding steps. It is what the
+    model saw when trained with BucketedSequence on the same buckets; pass
+    buckets=[seq_len] for models trained on padded data.
+    Models built with a fixed input length are simply given the padded data."""
+    seq_len = X_seqs[0].shape[1]
+    if not len(X_seqs[0]):
+        return np.zeros((0, seq_len, len(bio)), dtype=np.float32)
+    if input_shape(model)[1] is not None:
+        return model.predict(X_seqs, batch_size=batch_size)
+
+    buckets = [min(int(b), seq_len) for b in buckets]
+    bucket = _bucket_of(np.asarray(lengths), buckets)
+    Y_hat = None
+    for b, timesteps in enumerate(buckets):
+        idx = np.flatnonzero(bucket == b)
+        if not len(idx):
+            continue
+        pred = model.predict([X[idx, :timesteps] for X in X_seqs], batch_size=batch_size)
+        if Y_hat is None:
+            Y_hat = np.zeros((len(X_seqs[0]), seq_len, pred.shape[-1]), dtype=pred.dtype)
+        Y_hat[idx, :timesteps] = pred
+    return Y_hat
+
+def window_spans(lengths, seq_len, overlap):
+    """Splits sentences into chunks of at most seq_len tokens, where consecutive
+    chunks of a sentence share `overlap' tokens and the last one ends with the
+    sentence. Sentences up to seq_len tokens are a single chunk.
+    Returns (sent, start, stop): for each chunk, its sentence and token range."""
+    stride = seq_len - overlap
+    if stride < 1:
+        raise ValueError('overlap must be smaller than seq_len')
+    lengths = np.asarray(lengths, dtype=np.int64)
+    over = np.maximum(lengths - seq_len, 0)
+    n_chunks = 1 + -(-over // stride)
+    sent = np.repeat(np.arange(len(lengths)), n_chunks)
+    k = np.arange(len(sent)) - np.repeat(np.cumsum(n_chunks) - n_chunks, n_chunks)
+    start = np.minimum(k * stride, over[sent])
+    stop = np.minimum(start + seq_len, lengths[sent])
+    return sent, start, stop
+
+def _span_tokens(spans):
+    """Chunk number and position in the chunk of every token of every chunk."""
+    sent, start, stop = spans
+    chunk_len = stop - start
+    chunk = np.repeat(np.arange(len(sent)), chunk_len)
+    position = np.arange(chunk_len.sum()) - np.repeat(np.cumsum(chunk_len) - chunk_len, chunk_len)
+    return chunk, position
+
+def _window_flat(X, Y, offsets, spans):
+    """Cuts sentences held back to back (see _encode_shard()) into the chunks of
+    window_spans(), also back to back. Returns (X, Y, offsets) of the chunks."""
+    sent, start, _ = spans
+    chunk, position = _span_tokens(spans)
+    idx = np.asarray(offsets)[sent][chunk] + start[chunk] + position
+    chunk_offsets = np.concatenate(([0], np.cumsum(np.bincount(chunk, minlength=len(sent)), dtype=np.int64)))
+    return X[idx], Y[idx], chunk_offsets
+
+def stitch_windows(Y_hat, spans, policy='center'):
+    """Puts the per-token predictions of chunks (Y_hat of shape (n_chunks, seq_len, ...),
+    padded at the end) back together into one array per sentence.
+    policy: which prediction a token shared by two chunks gets.
+        'center': from the chunk where it is farthest from a cut (default);
+        'first' / 'last': from the earlier / later chunk;
+        'mean': the average of both (for probabilities)."""
+    sent, start, stop = spans
+    lengths = np.zeros(sent.max() + 1 if len(sent) else 0, dtype=np.int64)
+    np.maximum.at(lengths, sent, stop)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    chunk, position = _span_tokens(spans)
+    target = offsets[sent][chunk] + start[chunk] + position
+    values = np.asarray(Y_hat)[chunk, position]
+
+    if policy == 'mean':
+        out = np.zeros((offsets[-1],) + values.shape[1:], dtype=np.float64)
+        np.add.at(out, target, values)
+        counts = np.bincount(target, minlength=offsets[-1]).reshape((-1,) + (1,) * (values.ndim - 1))
+        out = (out / np.maximum(counts, 1)).astype(values.dtype)
+    else:
+        if policy == 'first':
+            score = -chunk
+        elif policy == 'last':
+            score = chunk
+        elif policy == 'center':
+            # Distance to the nearest end of the chunk that cuts the sentence.
+            left = np.where(start[chunk] > 0, position, np.iinfo(np.int64).max)
+            right = np.where(stop[chunk] < lengths[sent][chunk], stop[chunk] - start[chunk] - 1 - position,
+                             np.iinfo(np.int64).max)
+            score = np.minimum(left, right)
+        else:
+            raise ValueError('unknown policy: {}'.format(policy))
+        order = np.lexsort((-score, target))
+        _, first = np.unique(target[order], return_index=True)
+        out = values[order[first]]
+    return np.split(out, offsets[1:-1])
+
+class PrefetchBatches:
+
+    """Out-of-core input pipeline for fit_generator(), reading the BIO-marked
+    CoNLL-U shards in `<lang dir>/original/` (as load_data_from_treebank()).
+    A background thread parses and encodes sentences one at a time, shuffles them
+    within a window of `shuffle_window' sentences, and puts ready batches on a queue
+    of at most `prefetch' batches. Memory use depends on these two numbers, not on
+    the size of the corpus, and training starts as soon as the first batch is ready.
+    Batches are cut to the smallest bucket that fits their longest sentence, as in
+    BucketedSequence. Every epoch yields len(self) batches, so use:
+
+        train = PrefetchBatches(CONF, LANG, TRAIN_FILES, BATCHSIZE)
+        model.fit_generator(train, steps_per_epoch=len(train), epochs=EPOCHS)
+        train.close()
+    """
+
+    def __init__(self, conf, target_lang, files, batch_size, seq_len=80, buckets=BUCKETS,
+                 shuffle_window=2000, prefetch=32, sparse=False, shuffle=True, seed=None, packed=False):
+        self.conf = conf
+        self.paths = _shard_paths('original', target_lang, files)
+        self.batch_size = batch_size
+        self.seq_len = seq_len
+        self.buckets = sorted(set(min(int(b), seq_len) for b in buckets) | {seq_len})
+        self.shuffle_window = shuffle_window if shuffle else 0
+        self.sparse = sparse
+        self.shuffle = shuffle
+        self.packed = packed # One packed input, see pack_columns()
+        self.dtype = _ids_dtype(column2mapping[conf])
+        self._random = random.Random(seed)
+
+        # Sentences are counted from the sidecar indexes, without parsing.
+        self.n_sents = 0
+        for path in self.paths:
+            with TreebankIndex(path) as index:
+                self.n_sents += len(index)
+
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return -(-self.n_sents // self.batch_size)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        """Stops the background thread."""
+        self._stop.set()
+        self._thread.join()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            while not self._stop.is_set():
+                paths = list(self.paths)
+                if self.shuffle:
+                    self._random.shuffle(paths)
+                batch = []
+                for sent in self._shuffled(self._sentences(paths)):
+                    batch.append(sent)
+                    if len(batch) == self.batch_size:
+                        if not self._put(self._make_batch(batch)):
+                            return
+                        batch = []
+                if batch and not self._put(self._make_batch(batch)):
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _sentences(self, paths):
+        for path in paths:
+            with open(path, 'r') as fin:
+                for tree in read_trees(fin, bnp_marked=True, compact=True):
+                    yield tree.encode(self.conf)
+
+    def _shuffled(self, sents):
+        """Shuffles within a window: each new sentence takes the place of a random
+        one in the window, which is yielded."""
+        if self.shuffle_window < 1:
+            yield from sents
+            return
+        window = []
+        for sent in sents:
+            if len(window) < self.shuffle_window:
+                window.append(sent)
+                continue
+            j = self._random.randrange(len(window))
+            yield window[j]
+            window[j] = sent
+        self._random.shuffle(window)
+        yield from window
+
+    def _make_batch(self, batch):
+        lengths = [len(Y) for _, Y in batch]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        timesteps = self.buckets[_bucket_of(max(lengths), self.buckets)]
+        X = np.concatenate([X for X, _ in batch])
+        Y = np.concatenate([Y for _, Y in batch])
+        X_seqs = _pad_columns(X, offsets, timesteps, self.dtype)
+        Y_seqs = _labels_from_flat(Y, offsets, timesteps, self.sparse)
+        if self.sparse:
+            Y_seqs = Y_seqs[:, :, np.newaxis]
+        if self.packed:
+            X_seqs = [pack_columns(X_seqs, column2mapping[self.conf])]
+        return X_seqs, Y_seqs
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1<<20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _mappings_version():
+    """Changes whenever mappings.py is edited."""
+    return _file_hash(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mappings.py'))
+
+_rebuilt = set() # Cache entries already rebuilt by this process.
+
+def _cached_load(kind, paths, conf, seq_len, build, cache_dir=CACHEDIR, rebuild=False):
+    """Returns build() (a pair X_seqs, Y_seqs) through an on-disk cache.
+    The entry is keyed by the content of the source files, conf, seq_len, the version
+    of mappings.py and CACHE_VERSION, so it is invalidated when any of them changes.
+    Arrays are saved as raw .npy files and loaded with mmap_mode='r'.
+    kind: name of the loader, as different loaders read different files.
+    cache_dir: None to turn caching off.
+    rebuild: ignore an existing entry and build it again (once per process)."""
+    if cache_dir is None:
+        return build()
+
+    with _stage('cache_key'):
+        key = hashlib.sha1(repr((kind, [_file_hash(p) for p in paths], conf, seq_len,
+                                 _mappings_version(), CACHE_VERSION)).encode()).hexdigest()
+    entry = os.path.join(cache_dir, key)
+    if rebuild and key not in _rebuilt:
+        shutil.rmtree(entry, ignore_errors=True)
+        _rebuilt.add(key)
+
+    if not os.path.isdir(entry):
+        X_seqs, Y_seqs = build()
+        with _stage('cache_save'):
+            tmp = entry + '.tmp{}'.format(os.getpid())
+            os.makedirs(tmp, exist_ok=True)
+            # One (n_sents, seq_len, n_columns) array, see _pad_feats_seq().
+            np.save(os.path.join(tmp, 'X.npy'), np.stack(X_seqs, axis=-1))
+            np.save(os.path.join(tmp, 'Y.npy'), Y_seqs)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                # Another process got there first.
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    with _stage('cache_load'):
+        X3 = np.load(os.path.join(entry, 'X.npy'), mmap_mode='r')
+        X_seqs = [X3[:, :, j] for j in range(X3.shape[2])]
+        Y_seqs = np.load(os.path.join(entry, 'Y.npy'), mmap_mode='r')
+        profile = _current_profile()
+        if profile is not None and not profile['sentences']:
+            _count(len(Y_seqs), sequence_lengths(Y_seqs).sum())
+    return X_seqs, Y_seqs
+
+def clear_cache(cache_dir=CACHEDIR):
+    """Deletes all cached encoded shards."""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+def _concat_shards(shards, num_columns):
+    """Puts (X, Y, offsets) triples from _encode_shard() back to back."""
+    if not shards:
+        return np.zeros((0, num_columns), dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(1, dtype=np.int64)
+    X = np.concatenate([X for X, _, _ in shards])
+    Y = np.concatenate([Y for _, Y, _ in shards])
+    starts = np.cumsum([0] + [offsets[-1] for _, _, offsets in shards[:-1]])
+    offsets = np.concatenate([[0]] + [offsets[1:] + start for (_, _, offsets), start in zip(shards, starts)])
+    return X, Y, offsets
+
+@_profiled
+def load_data_from_files(seq_len, conf, target_lang, files: list, cache_dir=CACHEDIR, rebuild=False, sparse=False, superset=False):
     """target_lang: 'en', 'fr', 'both'
     This function should output: X_seqs and Y_gold.
     Which can be used to train, or used to compare against Y_hat.
     files: a list of integers, ie indices of files to open;
-        Use `-1' to indicate the test set."""
+        Use `-1' to indicate the test set.
+    cache_dir, rebuild: see _cached_load().
+    sparse: labels as ids instead of one-hot, see make_labels().
+    superset: if True, the columns of `conf' are taken as views from load_superset(),
+        which is shared by all configurations, instead of reading the TSV files of `conf'."""
+
+    if superset:
+        X_seqs, Y_seqs = load_superset(seq_len, target_lang, files, cache_dir, rebuild, sparse)
+        return [X_seqs[j] for j in column2superset[conf]], Y_seqs
+
+    paths = _shard_paths(conf, target_lang, files)
+    return _cached_load('files-sparse' if sparse else 'files', paths, conf, seq_len,
+                        lambda: _load_data_from_files(seq_len, conf, paths, sparse),
+                        cache_dir, rebuild)
 
+def _load_data_from_files(seq_len, conf, paths, sparse=False):
     mapping = column2mapping[conf]
     num_columns = len(mapping)
-    ENDIR = '/Users/tonghe/PROG/ThesisRepositoryOfTW/data/english/'
-    FRDIR = '/Users/tonghe/PROG/ThesisRepositoryOfTW/data/french/'
 
-    if -1 in files:
-        filenames = ['testset.txt']
-    else:
-        filenames = [str(i)+'.txt' for i in files]
+    # Shards are encoded one at a time, see _encode_shard(),
+    # and then put back to back.
+    shards = []
+    for path in paths:
+        with _stage('read'), open(path, 'r') as fin:
+            text = fin.read()
+        shards.append(_encode_shard(text, mapping))
+    with _stage('concat'):
+        X, Y, offsets = _concat_shards(shards, num_columns)
+    _count(len(offsets) - 1, len(Y))
 
-    sents_to_load = []
-    for fn in filenames:
-        if target_lang == 'en' or target_lang == 'both':
-            with open(ENDIR+conf+'/'+fn, 'r') as fin:
-                ftext = fin.read()
-                sents_to_load.extend(ftext.split('\n\n'))
-        if target_lang == 'fr' or target_lang == 'both':
-            with open(FRDIR+conf+'/'+fn, 'r') as fin:
-                ftext = fin.read()
-                sents_to_load.extend(ftext.split('\n\n'))
-
-    X_cats = [] # X in integers representing categories
-    Y_cats = [] # Y in integers representing categories
-    for sent in sents_to_load:
-        if sent:
-            X_singleton, Y_singleton = _make_array(sent, mapping)
-            X_cats.append(X_singleton)
-            Y_cats.append(Y_singleton)
-        else:
-            continue
-        
-    # print('X_cats')
-    # print(len(X_cats))
-    # print(X_cats)
-    #print('Y_cats') # Y is perf.
-    # print(len(Y_cats))
-    #print(Y_cats)
-
-    # print("Now let's see X_seqs, output from _pad_feats_seq.")
-    X_seqs = _pad_feats_seq(X_cats, seq_len, num_columns)
-
-    # THIS PART IS PERF!
-    #print("Let's see output from make_labels.")
-    Y_seqs = make_labels(Y_cats, seq_len)
-    #print(Y_seqs)
+    X_seqs = _pad_columns(X, offsets, seq_len, _ids_dtype(mapping))
+    Y_seqs = _labels_from_flat(Y, offsets, seq_len, sparse)
+
+    return X_seqs, Y_seqs
+
+@_profiled
+def load_data_from_treebank(seq_len, conf, target_lang, files: list, cache_dir=CACHEDIR, rebuild=False, sparse=False):
+    """Same as load_data_from_files(), but encodes the BIO-marked CoNLL-U shards
+    in `<lang dir>/original/` directly with Tree.encode(). The TSV files of the
+    configuration are not needed (nnwriter.py can still export them)."""
 
+    paths = _shard_paths('original', target_lang, files)
+    return _cached_load('treebank-sparse' if sparse else 'treebank', paths, conf, seq_len,
+                        lambda: _load_data_from_treebank(seq_len, conf, paths, sparse),
+                        cache_dir, rebuild)
+
+def _load_data_from_treebank(seq_len, conf, paths, sparse=False):
+    mapping = column2mapping[conf]
+    X, Y, offsets = _treebank_flat(paths, lambda tree: tree.encode(conf), len(mapping))
+    X_seqs = _pad_columns(X, offsets, seq_len, _ids_dtype(mapping))
+    Y_seqs = _labels_from_flat(Y, offsets, seq_len, sparse)
     return X_seqs, Y_seqs
 
+def _treebank_flat(paths, encode, num_columns):
+    """Encodes the non-empty trees of BIO-marked CoNLL-U shards with encode(tree)
+    and puts them back to back, as (X, Y, offsets) from _encode_shard()."""
+    X_cats = []
+    Y_cats = []
+    with _stage('parse+encode'):
+        for path in paths:
+            with open(path, 'r') as fin:
+                for tree in read_trees(fin, bnp_marked=True, compact=True):
+                    if len(tree):
+                        X_singleton, Y_singleton = encode(tree)
+                        X_cats.append(X_singleton)
+                        Y_cats.append(Y_singleton)
+
+    if not X_cats:
+        return _concat_shards([], num_columns)
+    with _stage('concat'):
+        offsets = np.concatenate(([0], np.cumsum([len(Y) for Y in Y_cats], dtype=np.int64)))
+        X, Y = np.concatenate(X_cats), np.concatenate(Y_cats)
+    _count(len(Y_cats), len(Y))
+    return X, Y, offsets
+
+@_profiled
+def load_superset(seq_len, target_lang, files: list, cache_dir=CACHEDIR, rebuild=False, sparse=False):
+    """Loads the BIO-marked CoNLL-U shards with every column in
+    mappings.superset_columns (see Tree.encode_superset()).
+    Returns (X_seqs, Y_seqs) with one array per superset column. They are all views
+    into one array, cached once for all configurations."""
+
+    paths = _shard_paths('original', target_lang, files)
+    return _cached_load('superset-sparse' if sparse else 'superset', paths, 'superset', seq_len,
+                        lambda: _load_superset(seq_len, paths, sparse),
+                        cache_dir, rebuild)
+
+def _load_superset(seq_len, paths, sparse=False):
+    X, Y, offsets = _treebank_flat(paths, lambda tree: tree.encode_superset(), len(superset_mapping))
+    X_seqs = _pad_columns(X, offsets, seq_len, _ids_dtype(superset_mapping))
+    Y_seqs = _labels_from_flat(Y, offsets, seq_len, sparse)
+    return X_seqs, Y_seqs
+
+class DatasetCache:
+
+    """In-process LRU cache of loaded (X_seqs, Y_seqs) pairs (or any nesting of arrays), so that drivers which
+    load the same shards again and again (predict.py, the training sweeps) pay for
+    each load once. Entries are evicted, least recently used first, when the arrays
+    held add up to more than max_bytes. Cached arrays are shared and read-only."""
+
+    def __init__(self, max_bytes=DATASET_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._rebuilt = set()
+
+    def get(self, key, load, rebuild=False):
+        """Returns the entry of `key', calling load() on a miss.
+        rebuild: drop the entry and load it again (once per process, as _cached_load())."""
+        if rebuild and key not in self._rebuilt:
+            self.discard(key)
+            self._rebuilt.add(key)
+        elif key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+        self.misses += 1
+        value = load()
+        arrays = list(_arrays(value))
+        for a in arrays:
+            a.flags.writeable = False
+        size = sum(a.nbytes for a in arrays)
+        if size <= self.max_bytes:
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+        return value
+
+    def discard(self, key):
+        if key in self._entries:
+            _, size = self._entries.pop(key)
+            self.nbytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.nbytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+def _arrays(value):
+    if isinstance(value, np.ndarray):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _arrays(v)
+
+DATASETS = DatasetCache()
+
+def load_data_cached(seq_len, conf, target_lang, files: list, loader=None, rebuild=False, sparse=False, superset=False, cache=DATASETS):
+    """Same as load_data_from_files() (or `loader', eg. load_data_from_treebank),
+    memoized in `cache' by (conf, target_lang, files, seq_len).
+    With superset=True, the superset of columns is cached once and shared by all
+    configurations, see load_superset()."""
+    files = tuple(files)
+    if superset:
+        X_seqs, Y_seqs = cache.get(('superset', target_lang, files, seq_len, load_superset.__name__, sparse),
+                                   lambda: load_superset(seq_len, target_lang, files, rebuild=rebuild, sparse=sparse),
+                                   rebuild)
+        return [X_seqs[j] for j in column2superset[conf]], Y_seqs
+
+    loader = loader or load_data_from_files
+    return cache.get((conf, target_lang, files, seq_len, loader.__name__, sparse),
+                     lambda: loader(seq_len, conf, target_lang, list(files), rebuild=rebuild, sparse=sparse),
+                     rebuild)
+
+@_profiled
+def load_windowed(seq_len, conf, target_lang, files: list, overlap=None, sparse=False, superset=False, cache=DATASETS):
+    """Loads the BIO-marked CoNLL-U shards like load_data_from_treebank(), but instead
+    of truncating sentences longer than seq_len, cuts them into overlapping chunks of
+    seq_len tokens (see window_spans()) which go in X_seqs and Y_seqs along with the
+    other sentences. Returns (X_seqs, Y_seqs, spans); pass the predictions and spans
+    to stitch_windows() to get one prediction per token of every sentence.
+    overlap: tokens shared by consecutive chunks, seq_len // 4 by default.
+    superset: window the superset of columns once for all configurations.
+    cache: a DatasetCache, or None."""
+    if overlap is None:
+        overlap = seq_len // 4
+    files = tuple(files)
+    paths = _shard_paths('original', target_lang, files)
+    if superset:
+        key = ('windowed', 'superset', target_lang, files, seq_len, overlap, sparse)
+        load = lambda: _load_windowed(seq_len, paths, lambda tree: tree.encode_superset(),
+                                      superset_mapping, overlap, sparse)
+    else:
+        key = ('windowed', conf, target_lang, files, seq_len, overlap, sparse)
+        load = lambda: _load_windowed(seq_len, paths, lambda tree: tree.encode(conf),
+                                      column2mapping[conf], overlap, sparse)
+
+    X_seqs, Y_seqs, spans = cache.get(key, load) if cache is not None else load()
+    if superset:
+        X_seqs = [X_seqs[j] for j in column2superset[conf]]
+    return X_seqs, Y_seqs, spans
+
+def _load_windowed(seq_len, paths, encode, mapping, overlap, sparse=False):
+    X, Y, offsets = _treebank_flat(paths, encode, len(mapping))
+    with _stage('window'):
+        spans = window_spans(np.diff(offsets), seq_len, overlap)
+        X, Y, offsets = _window_flat(X, Y, offsets, spans)
+    X_seqs = _pad_columns(X, offsets, seq_len, _ids_dtype(mapping))
+    Y_seqs = _labels_from_flat(Y, offsets, seq_len, sparse)
+    return X_seqs, Y_seqs, spans
+
 #a, b = load_data_from_files(150, 'pos_dep_grand_morph', 'fr', [100])
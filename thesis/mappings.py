@@ -69,3 +69,33 @@ column2mapping = {
     'pos_parent_child_morph': [pos2idx, definite2idx, gender2idx, number2idx, prontype2idx, person2idx, poss2idx, numtype2idx, case2idx, pos2idx, pos2idx, pos2idx],
     'pos_parent_morph': [pos2idx, definite2idx, gender2idx, number2idx, prontype2idx, person2idx, poss2idx, numtype2idx, case2idx, pos2idx]
 }
+
+# Superset of the feature columns of all configurations.
+# Tree.encode_superset() outputs every one of them, in this order,
+# and column2superset gives the indices of the columns of each configuration.
+superset_columns = ['pos', 'definite', 'gender', 'number', 'prontype', 'person', 'poss', 'numtype', 'case',
+                    'prev_is_head', 'next_is_head', 'prev_rel', 'next_rel',
+                    'rel', 'parent_pos', 'parent_rel', 'grand_pos',
+                    'lchild_rel', 'lchild_pos', 'rchild_rel', 'rchild_pos']
+superset_mapping = [pos2idx, definite2idx, gender2idx, number2idx, prontype2idx, person2idx, poss2idx, numtype2idx, case2idx,
+                    bool2idx, bool2idx, rel2idx, rel2idx,
+                    rel2idx, pos2idx, rel2idx, pos2idx,
+                    rel2idx, pos2idx, rel2idx, pos2idx]
+
+_morph_columns = ['definite', 'gender', 'number', 'prontype', 'person', 'poss', 'numtype', 'case']
+_base_columns = {
+    'pos': ['pos'],
+    'pos_dep': ['pos', 'prev_is_head', 'next_is_head'],
+    'pos_deprel': ['pos', 'prev_rel', 'next_rel'],
+    'pos_dep_parent': ['pos', 'rel', 'parent_pos'],
+    'pos_dep_grand': ['pos', 'rel', 'parent_pos', 'parent_rel', 'grand_pos'],
+    'pos_parent': ['pos', 'parent_pos'],
+    'pos_grand': ['pos', 'parent_pos', 'grand_pos'],
+    'pos_parent_child': ['pos', 'parent_pos', 'lchild_pos', 'rchild_pos'],
+    'pos_dep_parent_child': ['pos', 'rel', 'parent_pos', 'lchild_rel', 'lchild_pos', 'rchild_rel', 'rchild_pos']
+}
+column2superset = {}
+for _conf, _cols in _base_columns.items():
+    column2superset[_conf] = [superset_columns.index(c) for c in _cols]
+    # Morph features go right after POS.
+    column2superset[_conf+'_morph'] = [superset_columns.index(c) for c in _cols[:1] + _morph_columns + _cols[1:]]
@@ -1,15 +1,19 @@
 import numpy as np
+import os
 import random
+import sys
 import matplotlib.pyplot as plt
 import pickle
 from keras.layers.embeddings import Embedding
 from keras.layers.core import Activation, Dense, Dropout
 from keras.layers.recurrent import GRU, LSTM
-from keras.layers import Concatenate
+from keras.layers import Concatenate, Reshape
 from keras.layers import Input
 from keras.layers.wrappers import Bidirectional
 from keras.models import Model
+from keras.callbacks import EarlyStopping
 from helpers import *
+from training import *
 
 configurations = ['pos', 'pos_deprel', 'pos_dep', 'pos_dep_parent',
                   'pos_dep_grand', 'pos_parent', 'pos_grand', 'pos_parent_child',
@@ -28,51 +32,92 @@ OUTDIR = CONF+'/'
 #### Parameters to change ####
 MAXLEN = 80
 BATCHSIZE = 50
+BUCKETS = [10, 20, 30, 40, 60, MAXLEN] # Upper bounds of sentence lengths in a batch
+CORPUS_STATS = None # eg. ENDIR+'corpus_stats.json' from corpus_stats.py, to take MAXLEN and BUCKETS from the data; or such paths by LANG, {'en': ..., 'fr': ...}
+SPARSE_LABELS = False # Integer labels with sparse_categorical_crossentropy instead of one-hot
+SUPERSET = False # Take the columns of CONF from the encoding shared by all configurations (helpers.load_superset())
+FUSED = False # One packed input and one embedding table for all columns, see init_model()
+FUSED_DIM = 8 # Embedding size of every column in the fused table
+STREAMING = False # Parse and encode shards in the background while training, see helpers.PrefetchBatches
+MILESTONES = [30, 40, 50] # Epochs at which to save the model of one run. Don't run more epochs. You are not competing against any body.
+EARLY_STOPPING = None # Patience in epochs on val_ignore_accuracy, restoring the best weights; None to train for max(MILESTONES) epochs
+KFOLD = False # Train on all 10 folds (each shard held out once) instead of one random validation shard
+REBUILD_CACHE = '--rebuild' in sys.argv # Re-encode shards instead of using the cache in helpers.CACHEDIR
 
-# #### INPUT LAYER ####
-# # That handles mutable number of columns of input data
-mapping = column2mapping[CONF]
+# The parameters above, as set here; see configure().
+DEFAULTS = {name: globals()[name] for name in (
+    'LANG', 'CONF', 'MAXLEN', 'BATCHSIZE', 'BUCKETS', 'CORPUS_STATS', 'SPARSE_LABELS', 'SUPERSET',
+    'FUSED', 'FUSED_DIM', 'STREAMING', 'MILESTONES', 'EARLY_STOPPING', 'KFOLD', 'REBUILD_CACHE')}
 
-def init_model(RNN):
+def _param_str(value):
+    if isinstance(value, (list, tuple)):
+        return '-'.join(str(v) for v in value)
+    return str(value)
+
+def configure(**params):
+    """Sets parameters above, eg. configure(CONF='pos_morph', LANG='fr'), and
+    those that follow from them: MAXLEN and BUCKETS from CORPUS_STATS, and OUTDIR.
+    The others keep their values in DEFAULTS. Used by sweep.py.
+    Parameters that change the model but are not in its name (all but CONF and
+    LANG) go into OUTDIR when they differ from DEFAULTS, eg. `pos_dep FUSED=True/',
+    so that runs with different settings do not overwrite each other."""
+    global OUTDIR, mapping, LOSS, ACC
+    unknown = sorted(set(params) - set(DEFAULTS))
+    if unknown:
+        raise ValueError('unknown parameters: {}'.format(', '.join(unknown)))
+    settings = dict(DEFAULTS, **params)
+    stats = settings['CORPUS_STATS']
+    if isinstance(stats, dict):
+        stats = stats.get(settings['LANG'])
+    settings['MAXLEN'], settings['BUCKETS'] = read_padding_plan(stats, settings['MAXLEN'], settings['BUCKETS'])
+    globals().update(settings)
+
+    # CORPUS_STATS shows as the MAXLEN and BUCKETS it gives.
+    OUTDIR = CONF
+    for name in sorted(settings):
+        if name not in ('CONF', 'LANG', 'CORPUS_STATS', 'REBUILD_CACHE') and settings[name] != DEFAULTS[name]:
+            OUTDIR += ' {}={}'.format(name, _param_str(settings[name]))
+    OUTDIR += '/'
+    # #### INPUT LAYER ####
+    # # That handles mutable number of columns of input data
+    mapping = column2mapping[CONF]
+
+    if SPARSE_LABELS:
+        LOSS, ACC = 'sparse_categorical_crossentropy', ignore_accuracy_sparse
+    else:
+        LOSS, ACC = 'categorical_crossentropy', ignore_accuracy
+
+configure()
+
+def embedding_dim(input_dim):
+    """Size of the embedding of a column with input_dim ids:
+    2 for booleans and the like, 4 for small mappings, 8 for the others."""
+    if input_dim <= 3:
+        return 2
+    if input_dim <= 12:
+        return 4
+    return 8
+
+def init_model(RNN, fused=None):
+    """fused: one packed input of all columns and one embedding table, instead of
+    an input and an embedding per column. FUSED by default."""
+    fused = FUSED if fused is None else fused
 
     #############################################################
     ##### INPUT LAYER CHNAGES WITH MODEL AND GOES WITH CONF #####
-    input_pos1 = Input(shape=(MAXLEN,))
-    input_dep1 = Input(shape=(MAXLEN,)) # If the current token is related to the previous/next token
-    input_dep2 = Input(shape=(MAXLEN,))
-    # input_def = Input(shape=(MAXLEN,))
-    # input_gender = Input(shape=(MAXLEN,))
-    # input_number = Input(shape=(MAXLEN,))
-    # input_prontype = Input(shape=(MAXLEN,))
-    # input_person = Input(shape=(MAXLEN,))
-    # input_poss = Input(shape=(MAXLEN,))
-    # input_numtype = Input(shape=(MAXLEN,))
-    # input_case = Input(shape=(MAXLEN,))
-    # input_pos2 = Input(shape=(MAXLEN,))
-    # input_pos3 = Input(shape=(MAXLEN,))
-    # input_pos4 = Input(shape=(MAXLEN,))
-
-    INPUTS = [input_pos1, input_dep1, input_dep2]
-    #         , input_def, input_gender, input_number,
-    #           input_prontype, input_person, input_poss, input_numtype,
-    #           input_case, input_pos2, input_pos3, input_pos4]
-
-    EMBEDDINGS = [Embedding(18, 8)(input_pos1),
-                Embedding(2, 2)(input_dep1),
-                Embedding(2, 2)(input_dep2)]
-    #              Embedding(7, 4)(input_def),
-    #              Embedding(7, 4)(input_gender),
-    #              Embedding(12, 4)(input_number),
-    #              Embedding(20, 8)(input_prontype),
-    #              Embedding(8, 4)(input_person),
-    #              Embedding(3, 2)(input_poss),
-    #              Embedding(13, 8)(input_numtype),
-    #              Embedding(46, 8)(input_case),
-    #              Embedding(18, 8)(input_pos2),
-    #              Embedding(18, 8)(input_pos3),
-    #              Embedding(18, 8)(input_pos4)]
-
-    combined_inputs = Concatenate()(EMBEDDINGS)
+    # One input per column of column2mapping[CONF]. Timesteps are left open (None)
+    # so that BucketedSequence can feed batches cut to the length of their bucket.
+    sizes = [max(m.values()) + 1 for m in mapping]
+    if fused:
+        # Ids come shifted by column, see helpers.pack_columns(), so a single
+        # lookup embeds all columns of a timestep.
+        INPUTS = [Input(shape=(None, len(sizes)))]
+        embedded = Embedding(column_offsets(mapping)[1], FUSED_DIM)(INPUTS[0])
+        combined_inputs = Reshape((-1, len(sizes) * FUSED_DIM))(embedded)
+    else:
+        INPUTS = [Input(shape=(None,)) for _ in sizes]
+        EMBEDDINGS = [Embedding(n, embedding_dim(n))(input_col) for n, input_col in zip(sizes, INPUTS)]
+        combined_inputs = Concatenate()(EMBEDDINGS) if len(EMBEDDINGS) > 1 else EMBEDDINGS[0]
     ################ END CONFIGURATION ###################
     ######################################################
 
@@ -91,33 +136,93 @@ def init_model(RNN):
     model = Model(inputs=INPUTS, outputs=output)
     return model
 
-for RNN in ['GRU', 'LTSM']:
-    for EPOCHS in [50, 40, 30]: # Don't run more epochs. You are not competing against any body.
+def load_datasets(train_files, valid_files):
+    """Training and validation data for fit_generator()."""
+    if STREAMING:
+        train_data = PrefetchBatches(CONF, LANG, train_files, BATCHSIZE, MAXLEN, BUCKETS, sparse=SPARSE_LABELS, packed=FUSED)
+        valid_data = PrefetchBatches(CONF, LANG, valid_files, BATCHSIZE, MAXLEN, BUCKETS, sparse=SPARSE_LABELS, shuffle=False, packed=FUSED)
+    else:
+        X_train, Y_train = load_data_cached(MAXLEN, CONF, LANG, train_files, rebuild=REBUILD_CACHE, sparse=SPARSE_LABELS, superset=SUPERSET)
+        X_valid, Y_valid = load_data_cached(MAXLEN, CONF, LANG, valid_files, rebuild=REBUILD_CACHE, sparse=SPARSE_LABELS, superset=SUPERSET)
+        if FUSED:
+            X_train, X_valid = [pack_columns(X_train, mapping)], [pack_columns(X_valid, mapping)]
+        train_data = BucketedSequence(X_train, Y_train, BATCHSIZE, BUCKETS)
+        valid_data = BucketedSequence(X_valid, Y_valid, BATCHSIZE, BUCKETS, shuffle=False)
+    return train_data, valid_data
+
+def save_run(model, history, model_name):
+    """Saves the model, its history and the acc.txt summary under OUTDIR."""
+    with open(OUTDIR+model_name+' hist.pickle', 'wb') as hist_out:
+        pickle.dump(history, hist_out)
+    with open(OUTDIR+model_name+' acc.txt', 'w') as acc_out:
+        acc_out.write('# ignore accuracy\n')
+        acc_out.write(str(history[ACC.__name__])+'\n')
+        acc_out.write('# val_ignore_accuracy\n')
+        acc_out.write(str(history['val_'+ACC.__name__])+'\n')
+        acc_out.write('# train loss\n')
+        acc_out.write(str(history['loss'])+'\n')
+        acc_out.write('# val loss\n')
+        acc_out.write(str(history['val_loss'])+'\n')
+    model.save(OUTDIR+model_name+'.model')
+
+def train(RNN, train_files, valid_files, milestones=None, early_stopping=None, data=None):
+    """Trains one model for max(milestones) epochs and saves it at every milestone
+    as `<CONF> <LANG>_<RNN> ep<N> val<file>', the same as a separate N-epoch run.
+    early_stopping: patience on the validation ignore accuracy. The best weights,
+    whether or not training stops early, are restored and saved as `... best val<file>'.
+    Both default to MILESTONES and EARLY_STOPPING.
+    data: (train_data, valid_data) already made, eg. by ShardFolds.sequences()."""
+    milestones = milestones or MILESTONES
+    early_stopping = EARLY_STOPPING if early_stopping is None else early_stopping
+    v_file = valid_files[0]
+    os.makedirs(OUTDIR, exist_ok=True)
+
+    train_data, valid_data = data or load_datasets(train_files, valid_files)
+    this_model = init_model(RNN)
+    this_model.compile(optimizer="adam", loss=LOSS, metrics=['accuracy', ACC])
+
+    def on_milestone(model, epoch, history):
+        save_run(model, history, "{} {}_{} ep{} val{}".format(CONF, LANG, RNN, epoch, v_file))
+    callbacks = [MilestoneCheckpoint(milestones, on_milestone)]
+    if early_stopping is not None:
+        stopper = EarlyStopping(monitor='val_'+ACC.__name__, mode='max', patience=early_stopping,
+                                restore_best_weights=True)
+        callbacks.append(stopper)
+
+    try:
+        hist = this_model.fit_generator(train_data, steps_per_epoch=len(train_data), epochs=max(milestones),
+                                        validation_data=valid_data, validation_steps=len(valid_data),
+                                        callbacks=callbacks)
+    finally:
+        # Only the streaming pipelines made here; the caller owns `data'.
+        if data is None and STREAMING:
+            train_data.close()
+            valid_data.close()
+
+    if early_stopping is not None:
+        # EarlyStopping only restores the best weights when it stops the run.
+        if stopper.best_weights is not None:
+            this_model.set_weights(stopper.best_weights)
+        save_run(this_model, hist.history, "{} {}_{} best val{}".format(CONF, LANG, RNN, v_file))
+    return hist
+
+def cross_validate(RNN, files=range(10)):
+    """Trains one model per fold, each shard of `files' held out once for validation.
+    The shards are loaded once for all folds, see training.ShardFolds."""
+    folds = ShardFolds(MAXLEN, CONF, LANG, files, sparse=SPARSE_LABELS, superset=SUPERSET, packed=FUSED,
+                       rebuild=REBUILD_CACHE)
+    for v_file in folds.files:
+        train_files = [f for f in folds.files if f != v_file]
+        train(RNN, train_files, [v_file], data=folds.sequences(v_file, BATCHSIZE, BUCKETS))
+
+if __name__ == '__main__':
+    # A single configuration; sweep.py runs many of them in parallel.
+    for RNN in ['GRU', 'LTSM']:
+        if KFOLD:
+            cross_validate(RNN)
+            continue
         TRAIN_FILES = [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]
         random.shuffle(TRAIN_FILES)
         v_file = TRAIN_FILES.pop()
         VALID_FILES = [v_file]
-        X_train, Y_train = load_data_from_files(MAXLEN, CONF, LANG, TRAIN_FILES)
-        X_valid, Y_valid = load_data_from_files(MAXLEN, CONF, LANG, VALID_FILES)
-
-        this_model = init_model(RNN)
-        MODEL_NAME = "{} {}_{} ep{} val{}".format(CONF, LANG, RNN, EPOCHS, v_file)
-
-        with open(OUTDIR+MODEL_NAME+'_began.txt', 'w') as f_began:
-            f_began.write('Yup. I began!')
-
-        this_model.compile(optimizer="adam", loss='categorical_crossentropy', metrics=['accuracy', ignore_accuracy])
-        hist = this_model.fit(x=X_train, y=Y_train, batch_size = BATCHSIZE, epochs=EPOCHS, validation_data=(X_valid, Y_valid))
-
-        with open(OUTDIR+MODEL_NAME+' hist.pickle', 'wb') as hist_out:
-            pickle.dump(hist.history, hist_out)
-        with open(OUTDIR+MODEL_NAME+' acc.txt', 'w') as acc_out:
-            acc_out.write('# ignore accuracy\n')
-            acc_out.write(str(hist.history['ignore_accuracy'])+'\n')
-            acc_out.write('# val_ignore_accuracy\n')
-            acc_out.write(str(hist.history['val_ignore_accuracy'])+'\n')
-            acc_out.write('# train loss\n')
-            acc_out.write(str(hist.history['loss'])+'\n')
-            acc_out.write('# val loss\n')
-            acc_out.write(str(hist.history['val_loss'])+'\n')
-        this_model.save(OUTDIR+MODEL_NAME+'.model')
+        train(RNN, TRAIN_FILES, VALID_FILES)
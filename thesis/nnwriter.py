@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+from mappings import column2mapping
+from conllu import read_trees, list_shards
+
+class NNFeatsWriter:
+
+    """Writes the NN input files of many configurations in a single pass.
+    Each tree is parsed once and output_nnfeats_many() produces the rows of
+    every configuration, which are streamed to `outdir/<conf>/<filename>`
+    through buffered file handles.
+
+    Use as a context manager:
+        with NNFeatsWriter(ENDIR, '0.txt') as writer:
+            for tree in read_trees(fin, bnp_marked=True):
+                writer.write(tree)
+        print(writer.stats())
+    """
+
+    def __init__(self, outdir, filename, confs=None, buffering=1<<20):
+        """outdir: eg. data/english/; one subdirectory per configuration.
+        confs: configuration names, all of those in mappings.column2mapping by default.
+        buffering: buffer size in bytes of every output file."""
+        self.confs = list(confs) if confs else sorted(column2mapping)
+        self.files = {}
+        for conf in self.confs:
+            os.makedirs(os.path.join(outdir, conf), exist_ok=True)
+            self.files[conf] = open(os.path.join(outdir, conf, filename), 'w', buffering=buffering)
+
+        # Throughput counters, see stats()
+        self.sentences = 0
+        self.tokens = 0
+        self.chars = 0
+        self.started = time.perf_counter()
+
+    def write(self, tree):
+        """Appends one BIO-marked tree to the files of all configurations."""
+        for conf, output in tree.output_nnfeats_many(self.confs).items():
+            self.files[conf].write(output)
+            self.chars += len(output)
+        self.sentences += 1
+        self.tokens += len(tree)
+
+    def stats(self):
+        """Returns the counters so far, and sentences/tokens per second."""
+        elapsed = time.perf_counter() - self.started
+        return {'sentences': self.sentences, 'tokens': self.tokens, 'chars': self.chars,
+                'seconds': elapsed,
+                'sents_per_sec': self.sentences / elapsed if elapsed else 0.0,
+                'tokens_per_sec': self.tokens / elapsed if elapsed else 0.0}
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_all(langdir, filenames=None, confs=None):
+    """Regenerates `langdir/<conf>/<fn>` for every configuration from the
+    BIO-marked treebank shards in `langdir/original/<fn>`, one pass per shard.
+    filenames: shard file names, all shards in `langdir/original/` by default."""
+    srcdir = os.path.join(langdir, 'original')
+    if filenames is None:
+        filenames = list_shards(srcdir)
+    for fn in filenames:
+        with open(os.path.join(srcdir, fn), 'r') as fin, NNFeatsWriter(langdir, fn, confs) as writer:
+            for tree in read_trees(fin, bnp_marked=True, compact=True):
+                writer.write(tree)
+        st = writer.stats()
+        print('{}: {} sentences, {} tokens in {:.1f}s ({:.0f} tokens/s)'.format(
+            fn, st['sentences'], st['tokens'], st['seconds'], st['tokens_per_sec']))
+
+if __name__ == '__main__':
+    # python nnwriter.py /path/to/data/english [0.txt 1.txt ...]
+    write_all(sys.argv[1], sys.argv[2:] or None)
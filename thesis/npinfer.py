@@ -0,0 +1,221 @@
+"""Runs the models of network_traininng.init_model() with NumPy only.
+
+export_npz() dumps the layers and weights of a trained Keras model to a flat .npz;
+NumpyModel loads it and predicts without Keras or TensorFlow:
+
+    python npinfer.py enmodels/pos_dep.model    (writes enmodels/pos_dep.npz)
+
+    model = NumpyModel('enmodels/pos_dep.npz')
+    Y_hat = model.predict(X_seqs, batch_size=50)
+"""
+
+import json
+import sys
+import numpy as np
+
+def _inbound(layer):
+    nodes = getattr(layer, '_inbound_nodes', None) or layer.inbound_nodes
+    inbound = nodes[0].inbound_layers
+    if not isinstance(inbound, (list, tuple)):
+        inbound = [inbound]
+    return [l.name for l in inbound]
+
+def export_npz(model, path):
+    """Saves the layers of a Keras model (as built by init_model()) and their
+    weights to `path': weights as `<layer name>/<i>', the graph as JSON in `__spec__'."""
+    layers = []
+    arrays = {}
+    for layer in model.layers:
+        cls = type(layer).__name__
+        cfg = layer.get_config()
+        spec = {'name': layer.name, 'class': cls, 'inbound': _inbound(layer)}
+        if cls == 'InputLayer':
+            spec['shape'] = list(cfg['batch_input_shape'][1:])
+        elif cls in ('Dense', 'Activation'):
+            spec['activation'] = cfg['activation']
+        elif cls == 'Concatenate':
+            spec['axis'] = cfg['axis']
+        elif cls == 'Reshape':
+            spec['target_shape'] = list(cfg['target_shape'])
+        elif cls == 'Bidirectional':
+            inner = cfg['layer']['config']
+            if not inner.get('return_sequences'):
+                raise ValueError('{}: only RNNs with return_sequences=True are supported'.format(layer.name))
+            spec.update(rnn=cfg['layer']['class_name'], merge_mode=cfg['merge_mode'],
+                        activation=inner['activation'], recurrent_activation=inner['recurrent_activation'],
+                        reset_after=inner.get('reset_after', False))
+            if not inner.get('use_bias', True):
+                raise ValueError('{}: RNNs without bias are not supported'.format(layer.name))
+        elif cls not in ('Embedding', 'Dropout', 'SpatialDropout1D'):
+            raise ValueError('{}: {} layers are not supported'.format(layer.name, cls))
+        for i, w in enumerate(layer.get_weights()):
+            arrays['{}/{}'.format(layer.name, i)] = w
+        layers.append(spec)
+
+    spec = {'layers': layers, 'inputs': list(model.input_names), 'output': model.output_names[0]}
+    arrays['__spec__'] = np.array(json.dumps(spec))
+    np.savez(path, **arrays)
+
+
+def _hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+ACTIVATIONS = {'linear': lambda x: x, 'tanh': np.tanh, 'relu': lambda x: np.maximum(x, 0),
+               'sigmoid': _sigmoid, 'hard_sigmoid': _hard_sigmoid, 'softmax': _softmax}
+
+def gru(x, kernel, recurrent_kernel, bias, activation, recurrent_activation, reset_after=False):
+    """Keras GRU with return_sequences=True over x of shape (batch, timesteps, features)."""
+    act, rec_act = ACTIVATIONS[activation], ACTIVATIONS[recurrent_activation]
+    units = recurrent_kernel.shape[0]
+    if reset_after:
+        input_bias, recurrent_bias = bias[0], bias[1]
+    else:
+        input_bias, recurrent_bias = bias, None
+    # Input projections of all timesteps at once; only h @ U is left in the loop.
+    xw = x @ kernel + input_bias
+    U_zr, U_h = recurrent_kernel[:, :2*units], recurrent_kernel[:, 2*units:]
+    h = np.zeros((x.shape[0], units), dtype=x.dtype)
+    out = np.empty((x.shape[0], x.shape[1], units), dtype=x.dtype)
+    for t in range(x.shape[1]):
+        x_z, x_r, x_h = xw[:, t, :units], xw[:, t, units:2*units], xw[:, t, 2*units:]
+        if reset_after:
+            rec = h @ recurrent_kernel + recurrent_bias
+            z = rec_act(x_z + rec[:, :units])
+            r = rec_act(x_r + rec[:, units:2*units])
+            hh = act(x_h + r * rec[:, 2*units:])
+        else:
+            rec = h @ U_zr
+            z = rec_act(x_z + rec[:, :units])
+            r = rec_act(x_r + rec[:, units:])
+            hh = act(x_h + (r * h) @ U_h)
+        h = z * h + (1 - z) * hh
+        out[:, t] = h
+    return out
+
+def lstm(x, kernel, recurrent_kernel, bias, activation, recurrent_activation):
+    """Keras LSTM with return_sequences=True over x of shape (batch, timesteps, features)."""
+    act, rec_act = ACTIVATIONS[activation], ACTIVATIONS[recurrent_activation]
+    units = recurrent_kernel.shape[0]
+    xw = x @ kernel + bias
+    h = np.zeros((x.shape[0], units), dtype=x.dtype)
+    c = np.zeros_like(h)
+    out = np.empty((x.shape[0], x.shape[1], units), dtype=x.dtype)
+    for t in range(x.shape[1]):
+        g = xw[:, t] + h @ recurrent_kernel
+        i = rec_act(g[:, :units])
+        f = rec_act(g[:, units:2*units])
+        c = f * c + i * act(g[:, 2*units:3*units])
+        o = rec_act(g[:, 3*units:])
+        h = o * act(c)
+        out[:, t] = h
+    return out
+
+class NumpyModel:
+
+    """A model saved by export_npz(), run with NumPy. predict() takes and returns
+    the same arrays as the Keras model's; `inputs' and `input_shapes' stand in for
+    the Keras attributes used in helpers.predict_bucketed()."""
+
+    def __init__(self, path):
+        with np.load(path) as npz:
+            spec = json.loads(str(npz['__spec__']))
+            weights = {k: npz[k] for k in npz.files if k != '__spec__'}
+        self.layers = spec['layers']
+        self.inputs = spec['inputs']
+        self.output = spec['output']
+        shapes = {l['name']: l.get('shape') for l in self.layers}
+        self.input_shapes = [(None,) + tuple(shapes[name]) for name in self.inputs]
+        self.weights = {}
+        for l in self.layers:
+            n = sum(1 for k in weights if k.rsplit('/', 1)[0] == l['name'])
+            self.weights[l['name']] = [weights['{}/{}'.format(l['name'], i)].astype(np.float32) for i in range(n)]
+
+    def predict(self, X_seqs, batch_size=256):
+        if not isinstance(X_seqs, (list, tuple)):
+            X_seqs = [X_seqs]
+        n = len(X_seqs[0])
+        outputs = [self._forward([X[i:i+batch_size] for X in X_seqs]) for i in range(0, n, batch_size)]
+        return np.concatenate(outputs) if outputs else np.zeros((0,), dtype=np.float32)
+
+    def _forward(self, X_seqs):
+        values = dict(zip(self.inputs, X_seqs))
+        for l in self.layers:
+            name, cls, w = l['name'], l['class'], self.weights[l['name']]
+            if cls == 'InputLayer':
+                continue
+            x = [values[i] for i in l['inbound']]
+            if cls == 'Embedding':
+                y = w[0][np.asarray(x[0]).astype(np.intp)]
+            elif cls == 'Concatenate':
+                y = np.concatenate(x, axis=l['axis'])
+            elif cls == 'Reshape':
+                y = x[0].reshape((x[0].shape[0],) + tuple(l['target_shape']))
+            elif cls == 'Dense':
+                y = ACTIVATIONS[l['activation']](x[0] @ w[0] + (w[1] if len(w) > 1 else 0))
+            elif cls == 'Activation':
+                y = ACTIVATIONS[l['activation']](x[0])
+            elif cls == 'Bidirectional':
+                y = self._bidirectional(l, w, x[0])
+            else: # Dropout does nothing at inference.
+                y = x[0]
+            values[name] = y
+        return values[self.output]
+
+    def _bidirectional(self, l, w, x):
+        half = len(w) // 2
+        forward, backward = w[:half], w[half:]
+        if l['rnn'] == 'GRU':
+            run = lambda x, w: gru(x, w[0], w[1], w[2], l['activation'], l['recurrent_activation'], l['reset_after'])
+        else:
+            run = lambda x, w: lstm(x, w[0], w[1], w[2], l['activation'], l['recurrent_activation'])
+        y_fw = run(x, forward)
+        # The backward RNN reads the sequence from the end, padding first, as in Keras.
+        y_bw = run(x[:, ::-1], backward)[:, ::-1]
+        mode = l['merge_mode']
+        if mode == 'concat':
+            return np.concatenate([y_fw, y_bw], axis=-1)
+        if mode == 'sum':
+            return y_fw + y_bw
+        if mode == 'mul':
+            return y_fw * y_bw
+        if mode == 'ave':
+            return (y_fw + y_bw) / 2
+        raise ValueError('merge_mode {} is not supported'.format(mode))
+
+def check(keras_model, np_model, X_seqs, atol=1e-4):
+    """Largest difference between the Keras and the NumPy predictions on X_seqs;
+    raises an AssertionError if it is over atol."""
+    diff = float(np.abs(keras_model.predict(X_seqs) - np_model.predict(X_seqs)).max())
+    assert diff <= atol, 'NumPy model differs from Keras by {}'.format(diff)
+    return diff
+
+def _random_inputs(np_model, n=16, timesteps=20, seed=0):
+    """Valid random ids for every input, for check()."""
+    rng = np.random.RandomState(seed)
+    X_seqs = []
+    for name, shape in zip(np_model.inputs, np_model.input_shapes):
+        rows = [np_model.weights[l['name']][0].shape[0] for l in np_model.layers
+                if l['class'] == 'Embedding' and l['inbound'] == [name]]
+        size = (n, shape[1] or timesteps) + tuple(shape[2:])
+        X_seqs.append(rng.randint(0, rows[0] if rows else 2, size=size))
+    return X_seqs
+
+if __name__ == '__main__':
+    # python npinfer.py <model file> [<out .npz>]
+    # Exports a trained model and checks it against Keras on random input.
+    from keras.models import load_model
+    from helpers import ignore_accuracy, ignore_accuracy_sparse
+    model_file = sys.argv[1]
+    out = sys.argv[2] if len(sys.argv) > 2 else model_file.rsplit('.', 1)[0] + '.npz'
+    keras_model = load_model(model_file, custom_objects={'ignore_accuracy': ignore_accuracy,
+                                                         'ignore_accuracy_sparse': ignore_accuracy_sparse})
+    export_npz(keras_model, out)
+    np_model = NumpyModel(out)
+    print('{}: max difference from Keras {:.2e}'.format(out, check(keras_model, np_model, _random_inputs(np_model))))
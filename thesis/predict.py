@@ -1,10 +1,17 @@
 import os
+import sys
 from helpers import *
-from keras.models import load_model
-from conllu import Tree
+from conllu import read_trees
+from npinfer import NumpyModel
 import json
 
 MODELSDIR = "enmodels/"
+REBUILD_CACHE = '--rebuild' in sys.argv # Re-encode the test set instead of using the cache
+SUPERSET = True # Encode the test set once for all configurations, see helpers.load_superset()
+WINDOWED = True # Predict sentences longer than 80 tokens in overlapping chunks instead of truncating them, see helpers.load_windowed()
+WINDOW_OVERLAP = 20
+STITCH = 'center' # Which chunk a shared token takes its prediction from, see helpers.stitch_windows()
+PREDICT_BUCKETS = BUCKETS # The buckets the models were trained on; [80] for models trained on padded data, see helpers.predict_bucketed()
 ENSECTION = "/Users/tonghe/PROG/ThesisRepositoryOfTW/data/english/"
 FRSECTION = "/Users/tonghe/PROG/ThesisRepositoryOfTW/data/french/"
 configurations = ['pos', 'pos_deprel', 'pos_dep', 'pos_dep_parent',
@@ -22,16 +29,12 @@ en_test_source = ENSECTION + 'original/testset.txt'
 fr_test_source = FRSECTION + 'original/testset.txt'
 
 with open(en_test_source, 'r') as enin:
-    sents = enin.read().split('\n\n')
-    for sent in sents:
-        this_tree = Tree(sent, mnp_marked=True)
+    for this_tree in read_trees(enin, bnp_marked=True):
         Xen_words.append(this_tree.list_forms())
         Yen_gold.append(this_tree.list_bios())
 
 with open(fr_test_source, 'r') as frin:
-    sents = frin.read().split('\n\n')
-    for sent in sents:
-        this_tree = Tree(sent, mnp_marked=True)
+    for this_tree in read_trees(frin, bnp_marked=True):
         Xfr_words.append(this_tree.list_forms())
         Yfr_gold.append(this_tree.list_bios())
 
@@ -50,10 +53,24 @@ with open('Yfr_gold.json', 'w') as fryg_out:
 for CONF in configurations:
 
     model_file = MODELSDIR + CONF+'.model'
-    this_model = load_model(model_file, custom_objects={'ignore_accuracy': ignore_accuracy})
-
-    Xen_gold, _ = load_data_from_files(80, CONF, 'en', [-1])
-    Yen_hat = np.argmax(this_model.predict(Xen_gold), axis=2)
+    npz_file = MODELSDIR + CONF+'.npz' # From `python npinfer.py <model file>'
+    if os.path.exists(npz_file) and (not os.path.exists(model_file) or
+                                     os.path.getmtime(npz_file) >= os.path.getmtime(model_file)):
+        # NumPy only, Keras and TensorFlow are not imported.
+        this_model = NumpyModel(npz_file)
+    else:
+        if os.path.exists(npz_file):
+            print('{} is older than {}, using Keras; run npinfer.py on it again'.format(npz_file, model_file))
+        from keras.models import load_model
+        this_model = load_model(model_file, custom_objects={'ignore_accuracy': ignore_accuracy, 'ignore_accuracy_sparse': ignore_accuracy_sparse})
+
+    if WINDOWED:
+        Xen_gold, Yen_labels, en_spans = load_windowed(80, CONF, 'en', [-1], WINDOW_OVERLAP, sparse=True, superset=SUPERSET)
+        Yen_prob = stitch_windows(predict_bucketed(this_model, model_inputs(this_model, Xen_gold, CONF), sequence_lengths(Yen_labels), 50, PREDICT_BUCKETS), en_spans, STITCH)
+        Yen_hat = [np.argmax(sent, axis=1) for sent in Yen_prob]
+    else:
+        Xen_gold, Yen_labels = load_data_cached(80, CONF, 'en', [-1], rebuild=REBUILD_CACHE, sparse=True, superset=SUPERSET)
+        Yen_hat = np.argmax(predict_bucketed(this_model, model_inputs(this_model, Xen_gold, CONF), sequence_lengths(Yen_labels), 50, PREDICT_BUCKETS), axis=2)
 
     # for k in Y_hat:
     #     print(len(k))
@@ -68,8 +85,13 @@ for CONF in configurations:
         json.dump(predictions, en_pred_out)
     
 
-    Xfr_gold, _ = load_data_from_files(80, CONF, 'fr', [-1])
-    Yfr_hat = np.argmax(this_model.predict(Xfr_gold), axis=2)
+    if WINDOWED:
+        Xfr_gold, Yfr_labels, fr_spans = load_windowed(80, CONF, 'fr', [-1], WINDOW_OVERLAP, sparse=True, superset=SUPERSET)
+        Yfr_prob = stitch_windows(predict_bucketed(this_model, model_inputs(this_model, Xfr_gold, CONF), sequence_lengths(Yfr_labels), 50, PREDICT_BUCKETS), fr_spans, STITCH)
+        Yfr_hat = [np.argmax(sent, axis=1) for sent in Yfr_prob]
+    else:
+        Xfr_gold, Yfr_labels = load_data_cached(80, CONF, 'fr', [-1], rebuild=REBUILD_CACHE, sparse=True, superset=SUPERSET)
+        Yfr_hat = np.argmax(predict_bucketed(this_model, model_inputs(this_model, Xfr_gold, CONF), sequence_lengths(Yfr_labels), 50, PREDICT_BUCKETS), axis=2)
 
     # for k in Y_hat:
     #     print(len(k))
@@ -81,4 +103,6 @@ for CONF in configurations:
         predictions.append(labels)
 
     with open(CONF+'_fr_pred.json', 'w') as fr_pred_out:
-        json.dump(predictions, fr_pred_out)
\ No newline at end of file
+        json.dump(predictions, fr_pred_out)
+
+print('Dataset cache:', DATASETS.stats())
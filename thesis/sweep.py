@@ -0,0 +1,100 @@
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+#### Parameters to change ####
+configurations = ['pos', 'pos_deprel', 'pos_dep', 'pos_dep_parent',
+                  'pos_dep_grand', 'pos_parent', 'pos_grand', 'pos_parent_child',
+                  'pos_dep_parent_child', 'pos_morph', 'pos_deprel_morph',
+                  'pos_dep_morph', 'pos_dep_parent_morph', 'pos_dep_grand_morph',
+                  'pos_parent_morph', 'pos_grand_morph', 'pos_parent_child_morph',
+                  'pos_dep_parent_child_morph']
+# Every combination is one trial. RNN and VALID (the validation file) are arguments
+# of network_traininng.train(); the other keys set the parameters of network_traininng.py.
+GRID = {'CONF': configurations,
+        'LANG': ['en'],
+        'RNN': ['GRU', 'LTSM'],
+        'VALID': [0]}
+THREADS = 2 # Intra-op threads of each worker; inter-op threads are capped at 1
+WORKERS = max(1, (os.cpu_count() or 1) // THREADS)
+RESULTS = 'sweep_results.jsonl' # One line per completed trial; those are skipped when the sweep is run again
+#### Parameters to change ####
+
+def trials(grid):
+    """All combinations of the values in `grid', as dicts."""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+def trial_name(params):
+    return ' '.join('{}={}'.format(k, params[k]) for k in sorted(params))
+
+def completed(path):
+    """Names of the trials recorded in the results file."""
+    done = set()
+    if os.path.exists(path):
+        with open(path, 'r') as fin:
+            for line in fin:
+                if line.strip():
+                    done.add(json.loads(line)['trial'])
+    return done
+
+def _init_worker(threads):
+    """Caps the threads of the numeric libraries in a worker before TensorFlow
+    is imported, so that WORKERS * THREADS cores are used in all."""
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    import tensorflow as tf
+    if hasattr(tf, 'config') and hasattr(tf.config, 'threading'):
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    else:
+        from keras import backend as K
+        K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                                       inter_op_parallelism_threads=1)))
+
+def _run_trial(params):
+    """Trains one trial in a worker and returns its record for the results file."""
+    import network_traininng as nt
+    started = time.time()
+    settings = {k: v for k, v in params.items() if k not in ('RNN', 'VALID')}
+    train_files = [f for f in range(10) if f != params['VALID']]
+    try:
+        nt.configure(**settings)
+        hist = nt.train(params['RNN'], train_files, [params['VALID']])
+    except Exception as e:
+        return {'trial': trial_name(params), 'params': params, 'error': repr(e)}
+    history = {k: [float(x) for x in v] for k, v in hist.history.items()}
+    val_acc = history.get('val_'+nt.ACC.__name__, [])
+    return {'trial': trial_name(params), 'params': params, 'seconds': time.time() - started,
+            'epochs': len(history.get('loss', [])),
+            'best_val_acc': max(val_acc) if val_acc else None, 'history': history}
+
+def run(grid=GRID, workers=WORKERS, threads=THREADS, results=RESULTS):
+    """Runs the trials of `grid' not yet in `results' in a pool of worker processes.
+    Each worker trains one trial at a time and is replaced after it, so that
+    every trial starts from a fresh Keras session."""
+    done = completed(results)
+    all_trials = trials(grid)
+    todo = [params for params in all_trials if trial_name(params) not in done]
+    print('{} trials, {} done, {} to run on {} workers'.format(len(all_trials), len(all_trials) - len(todo), len(todo), workers))
+    if not todo:
+        return
+
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(threads,), maxtasksperchild=1) as pool, \
+            open(results, 'a') as fout:
+        for record in pool.imap_unordered(_run_trial, todo):
+            if 'error' in record:
+                # Not recorded, so it is run again next time.
+                print('FAILED {}: {}'.format(record['trial'], record['error']))
+                continue
+            fout.write(json.dumps(record) + '\n')
+            fout.flush()
+            print('done {} ({:.0f}s, best val acc {})'.format(record['trial'], record['seconds'], record['best_val_acc']))
+
+if __name__ == '__main__':
+    # python sweep.py [--rebuild]; --rebuild reaches network_traininng.py in the workers.
+    run()
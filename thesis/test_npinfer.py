@@ -0,0 +1,49 @@
+"""npinfer.gru() and npinfer.lstm() against outputs of Keras 2.3.1 (TensorFlow 1.15)
+layers given the same weights. Run with `python -m pytest test_npinfer.py', or
+`python test_npinfer.py'."""
+
+import numpy as np
+from npinfer import gru, lstm
+
+def _weights(gates, reset_after=False):
+    """Kernel, recurrent kernel and bias of a layer with 3 features and 2 units,
+    as given to the Keras layers with set_weights()."""
+    rng = np.random.RandomState(1)
+    kernel = rng.uniform(-1, 1, (3, gates * 2)).astype(np.float32)
+    recurrent_kernel = rng.uniform(-1, 1, (2, gates * 2)).astype(np.float32)
+    bias = rng.uniform(-1, 1, (2, gates * 2) if reset_after else (gates * 2,)).astype(np.float32)
+    return kernel, recurrent_kernel, bias
+
+# Input of shape (batch 2, timesteps 3, features 3).
+X = np.random.RandomState(0).uniform(-1, 1, (2, 3, 3)).astype(np.float32)
+
+# GRU(2, return_sequences=True, recurrent_activation='hard_sigmoid')
+GRU_HARD_SIGMOID = [[[0.1544902, -0.1342683], [0.2598158, -0.2950034], [0.2654583, -0.1213950]],
+                    [[0.3059803, 0.0254848], [0.2221107, -0.1094645], [0.5656514, -0.0363017]]]
+# GRU(2, return_sequences=True, reset_after=True, recurrent_activation='sigmoid')
+GRU_RESET_AFTER = [[[0.3733774, 0.0211963], [0.5195831, 0.0166990], [0.4390415, 0.2245822]],
+                   [[0.5047324, 0.1561667], [0.5881566, 0.2174812], [0.7617527, 0.3479262]]]
+# LSTM(2, return_sequences=True, recurrent_activation='sigmoid')
+LSTM_SIGMOID = [[[-0.2754408, 0.0913622], [-0.3056306, 0.0145516], [-0.1813704, 0.2758835]],
+                [[-0.2850332, 0.1451494], [-0.4277826, 0.0003692], [-0.0131770, 0.0296172]]]
+# LSTM(2, return_sequences=True, recurrent_activation='hard_sigmoid')
+LSTM_HARD_SIGMOID = [[[-0.2591297, 0.0899335], [-0.2894341, 0.0142088], [-0.1840576, 0.2630368]],
+                     [[-0.2660624, 0.1423528], [-0.4023403, -0.0009740], [0.0070446, 0.0339387]]]
+
+def test_gru():
+    np.testing.assert_allclose(gru(X, *_weights(3), 'tanh', 'hard_sigmoid'), GRU_HARD_SIGMOID, atol=1e-6)
+
+def test_gru_reset_after():
+    np.testing.assert_allclose(gru(X, *_weights(3, reset_after=True), 'tanh', 'sigmoid', reset_after=True),
+                               GRU_RESET_AFTER, atol=1e-6)
+
+def test_lstm():
+    np.testing.assert_allclose(lstm(X, *_weights(4), 'tanh', 'sigmoid'), LSTM_SIGMOID, atol=1e-6)
+
+def test_lstm_hard_sigmoid():
+    np.testing.assert_allclose(lstm(X, *_weights(4), 'tanh', 'hard_sigmoid'), LSTM_HARD_SIGMOID, atol=1e-6)
+
+if __name__ == '__main__':
+    for test in (test_gru, test_gru_reset_after, test_lstm, test_lstm_hard_sigmoid):
+        test()
+    print('ok')
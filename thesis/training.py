@@ -0,0 +1,123 @@
+"""The Keras parts of training: BucketedSequence and MilestoneCheckpoint, and
+ShardFolds for cross-validation. Loading and padding are in helpers.py, which
+does not import Keras."""
+
+import numpy as np
+from keras.utils import Sequence
+from keras.callbacks import Callback
+from helpers import *
+from helpers import _bucket_of
+
+class BucketedSequence(Sequence):
+
+    """Feeds padded data to fit_generator() in batches of sentences of similar length.
+    Sentences are grouped in buckets by length, and each batch is cut to the upper
+    bound of its bucket, so a batch of short sentences does not carry 80 timesteps
+    of padding through the RNN. Needs a model with variable timesteps (see init_model()).
+
+    X_seqs, Y_seqs: as returned by load_data_from_files() (post-padded).
+    buckets: increasing upper bounds of sentence length; the last one should be seq_len.
+    indices: only feed these rows of X_seqs and Y_seqs (eg. one fold, see ShardFolds).
+    lengths: sequence_lengths(Y_seqs), if already known."""
+
+    def __init__(self, X_seqs, Y_seqs, batch_size, buckets=BUCKETS, shuffle=True, indices=None, lengths=None):
+        self.X_seqs = X_seqs
+        self.Y_seqs = Y_seqs
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        seq_len = Y_seqs.shape[1]
+        self.buckets = [min(int(b), seq_len) for b in buckets]
+        if lengths is None:
+            lengths = sequence_lengths(Y_seqs)
+        self.rows = np.arange(len(Y_seqs)) if indices is None else np.sort(indices)
+        self.bucket = _bucket_of(np.asarray(lengths)[self.rows], self.buckets)
+        self.on_epoch_end()
+
+    def on_epoch_end(self):
+        """Makes the batches: (sentence indices, timesteps) pairs."""
+        self.batches = []
+        for b, timesteps in enumerate(self.buckets):
+            idx = self.rows[self.bucket == b]
+            if self.shuffle:
+                np.random.shuffle(idx)
+            for i in range(0, len(idx), self.batch_size):
+                # Sorted, so the rows are read in order from (memory-mapped) arrays.
+                self.batches.append((np.sort(idx[i:i+self.batch_size]), timesteps))
+        if self.shuffle:
+            np.random.shuffle(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, i):
+        idx, timesteps = self.batches[i]
+        Y = self.Y_seqs[idx, :timesteps]
+        if Y.ndim == 2:
+            # Sparse labels, Keras wants them as (batch, timesteps, 1).
+            Y = Y[:, :, np.newaxis]
+        return ([X[idx, :timesteps] for X in self.X_seqs], Y)
+
+class MilestoneCheckpoint(Callback):
+
+    """Calls on_milestone(model, epoch, history) at the end of each epoch in
+    `milestones' (counted from 1), so that one long run gives the models of
+    shorter runs too, eg. milestones=[30, 40, 50] in a 50-epoch run.
+    history: the logs of the epochs so far, as in History.history."""
+
+    def __init__(self, milestones, on_milestone):
+        super().__init__()
+        self.milestones = set(milestones)
+        self.on_milestone = on_milestone
+        self.history = {}
+
+    def on_epoch_end(self, epoch, logs=None):
+        for k, v in (logs or {}).items():
+            self.history.setdefault(k, []).append(v)
+        if epoch + 1 in self.milestones:
+            self.on_milestone(self.model, epoch + 1, {k: list(v) for k, v in self.history.items()})
+
+class ShardFolds:
+
+    """Shards loaded once for cross-validation. Every shard in `files' is loaded with
+    load_data_from_files() (through the on-disk cache) and put into one contiguous
+    array, shard after shard; a fold is then just the row indices of its shards.
+
+        folds = ShardFolds(80, 'pos_dep', 'en')
+        for v in folds.files:
+            train_data, valid_data = folds.sequences(v, BATCHSIZE)
+
+    packed: keep X as one packed input, see pack_columns()."""
+
+    def __init__(self, seq_len, conf, target_lang, files=range(10), sparse=False, superset=False, packed=False,
+                 cache_dir=CACHEDIR, rebuild=False):
+        self.files = list(files)
+        X_cats = []
+        Y_cats = []
+        for f in self.files:
+            X_seqs, Y_seqs = load_data_from_files(seq_len, conf, target_lang, [f], cache_dir, rebuild, sparse, superset)
+            X_cats.append(np.stack(X_seqs, axis=-1))
+            Y_cats.append(np.asarray(Y_seqs))
+        X3 = np.concatenate(X_cats)
+        if packed:
+            self.X_seqs = [pack_columns([X3[:, :, j] for j in range(X3.shape[2])], column2mapping[conf])]
+        else:
+            self.X_seqs = [X3[:, :, j] for j in range(X3.shape[2])]
+        self.Y_seqs = np.concatenate(Y_cats)
+        self.lengths = sequence_lengths(self.Y_seqs)
+        # Rows of shard files[i] are offsets[i]:offsets[i+1].
+        self.offsets = np.concatenate(([0], np.cumsum([len(Y) for Y in Y_cats])))
+        self.shard = np.repeat(np.arange(len(self.files)), np.diff(self.offsets))
+
+    def fold(self, valid):
+        """(train rows, validation rows) with `valid' (a file or a list of files) held out."""
+        valid = [valid] if np.isscalar(valid) else list(valid)
+        held_out = np.isin(self.shard, [self.files.index(f) for f in valid])
+        return np.flatnonzero(~held_out), np.flatnonzero(held_out)
+
+    def sequences(self, valid, batch_size, buckets=BUCKETS):
+        """BucketedSequences for training and validation on fold(valid), sharing the arrays."""
+        train_rows, valid_rows = self.fold(valid)
+        return (BucketedSequence(self.X_seqs, self.Y_seqs, batch_size, buckets,
+                                 indices=train_rows, lengths=self.lengths),
+                BucketedSequence(self.X_seqs, self.Y_seqs, batch_size, buckets, shuffle=False,
+                                 indices=valid_rows, lengths=self.lengths))